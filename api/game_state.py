@@ -0,0 +1,43 @@
+import threading
+
+
+class GameState:
+    """ゲームの状態をメモリ上に保持し、スレッド間で共有するクラス"""
+
+    ACTIVE = "ACTIVE"
+    INACTIVE = "INACTIVE"
+
+    def __init__(self, status=INACTIVE):
+        """
+        :param status: 初期状態 (ACTIVE / INACTIVE)
+        """
+        self._condition = threading.Condition()
+        self.status = status
+        self.version = 0
+
+    def set(self, status):
+        """状態を更新し、変化があれば待機中のスレッドに通知する"""
+        with self._condition:
+            if status == self.status:
+                return False
+            self.status = status
+            self.version += 1
+            self._condition.notify_all()
+        return True
+
+    def get(self):
+        """現在の状態とバージョンを返す"""
+        with self._condition:
+            return self.status, self.version
+
+    def is_active(self):
+        return self.status == self.ACTIVE
+
+    def wait_for_change(self, version, timeout=None):
+        """
+        バージョンが version から変わるまで待つ
+
+        :return: 変化があれば True、タイムアウトした場合は False
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.version != version, timeout)
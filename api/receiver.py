@@ -1,72 +1,168 @@
-import socket
+import asyncio
+import codecs
 import json
 import os
+import threading
+
+from api.game_state import GameState
+from config import config
 
 class ReceiverTCP:
-    def __init__(self, host="127.0.0.1", port=3035, buffer_size=1024, env_path="./common/.env"):
+    def __init__(self, host=None, port=None, buffer_size=None, env_path=None, game_state=None):
         """
         ReceiverTCPクラス: 指定されたホストとポートでTCPサーバーを起動し、ゲーム状態を受信する。
 
-        :param host: 受信するホスト (デフォルト: 127.0.0.1)
-        :param port: 受信するポート (デフォルト: 3035)
-        :param buffer_size: 受信バッファサイズ (デフォルト: 1024)
-        :param env_path: .envファイルのパス (デフォルト: ./common/.env)
+        複数のクライアントからの持続的な接続を asyncio で同時に扱い、JSON オブジェクトを
+        改行区切り (または連続した JSON) として読み取る。
+
+        :param host: 受信するホスト (デフォルト: config.RECEIVER_HOST)
+        :param port: 受信するポート (デフォルト: config.RECEIVER_PORT)。0 の場合は空いているポートを使う
+        :param buffer_size: 受信バッファサイズ (デフォルト: config.RECEIVER_BUFFER_SIZE)
+        :param env_path: .envファイルのパス。None の場合は config.ENV_PATH、空文字列の場合は書き込まない
+        :param game_state: 受信した状態を公開する GameState (省略時は新規に生成)
         """
-        self.host = host
-        self.port = port
-        self.buffer_size = buffer_size
-        self.env_path = env_path  # .env ファイルのパス
+        self.host = host or config.RECEIVER_HOST
+        self.port = config.RECEIVER_PORT if port is None else port
+        self.buffer_size = buffer_size or config.RECEIVER_BUFFER_SIZE
+        self.env_path = config.ENV_PATH if env_path is None else env_path  # .env ファイルのパス
+        self.game_state = game_state if game_state is not None else GameState(config.GAME_STATUS)
+        self.loop = None
+        self.server = None
+        self._env_write_handle = None
 
     def start_server(self):
-        """ TCPサーバーを起動し、クライアントからの接続を待ち受ける """
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-            server_socket.bind((self.host, self.port))
-            server_socket.listen(5)  # 最大5クライアント接続待ち
-            print(f"[*] ReceiverTCP started on {self.host}:{self.port}, waiting for connections...")
-
+        """ TCPサーバーを起動し、クライアントからの接続を待ち受ける (終了するまで戻らない) """
+        try:
+            asyncio.run(self.serve())
+        except OSError as e:
+            print(f"[!] ReceiverTCP could not start on {self.host}:{self.port}: {e}")
+
+    def start_in_thread(self):
+        """ 別スレッドのイベントループでサーバーを起動する """
+        thread = threading.Thread(target=self.start_server, name="ReceiverTCP", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """ 別スレッドから呼び出してサーバーを停止する """
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        # port=0 の場合に OS が割り当てたポートを呼び出し側から参照できるようにする
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"[*] ReceiverTCP started on {self.host}:{self.port}, waiting for connections...")
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    async def handle_client(self, reader, writer):
+        """ クライアントが接続を閉じるまでデータを受信し、JSON を1つずつ処理する """
+        addr = writer.get_extra_info("peername")
+        print(f"[*] Connected by {addr}")
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buffer = ""
+
+        try:
             while True:
-                client_socket, addr = server_socket.accept()
-                print(f"[*] Connected by {addr}")
-                self.handle_client(client_socket)
+                chunk = await reader.read(self.buffer_size)
+                if not chunk:
+                    break
+                buffer = self.consume_messages(buffer + decoder.decode(chunk))
+                if len(buffer) > config.RECEIVER_MAX_MESSAGE_SIZE:
+                    print("[!] Message too large. Discarding buffer.")
+                    buffer = ""
+
+            if buffer.strip():
+                self.handle_message(buffer)
+        except ConnectionError as e:
+            print(f"[!] Connection Error: {e}")
+        except asyncio.CancelledError:
+            pass  # サーバー停止時
+        finally:
+            writer.close()
+            print(f"[*] Disconnected {addr}")
+
+    def consume_messages(self, buffer):
+        """
+        バッファから完全な JSON をすべて取り出して処理する
 
-    def handle_client(self, client_socket):
-        """ クライアントからデータを受信し、処理する """
-        with client_socket:
+        :return: まだ完結していない残りのバッファ
+        """
+        decoder = json.JSONDecoder()
+        while True:
+            buffer = buffer.lstrip()
+            if not buffer:
+                return buffer
             try:
-                data = client_socket.recv(self.buffer_size).decode('utf-8')  # バイトデータを文字列にデコード
-                print(f"[*] Raw Data Received: {data}")  # デバッグ用にデータを出力
-
-                if not data:
-                    print("[!] No data received.")
-                    return
-
-                # JSONデコードを試みる
-                received_json = json.loads(data)
-                if not isinstance(received_json, dict):  # JSONが辞書型でない場合エラー
-                    raise ValueError("Received JSON is not a dictionary.")
-
-                # is_game_active の取得
-                is_game_active = received_json.get("is_game_active")
-                print(f"[*] Game Status Received: is_game_active = {is_game_active}")
-
-                # 受信データに基づいて処理を実行
-                self.process_game_status(is_game_active)
-
+                received_json, end = decoder.raw_decode(buffer)
             except json.JSONDecodeError:
-                print("[!] JSON Decode Error: Invalid JSON format.")
-            except ValueError as e:
-                print(f"[!] Value Error: {e}")
+                # 改行までで JSON にならない行は不正な形式として捨てる
+                newline = buffer.find("\n")
+                if newline < 0:
+                    return buffer
+                self.handle_message(buffer[:newline])
+                buffer = buffer[newline + 1:]
+                continue
+            self.handle_json(received_json)
+            buffer = buffer[end:]
+
+    def handle_message(self, data):
+        """ 1メッセージ分の文字列を JSON として処理する """
+        print(f"[*] Raw Data Received: {data}")  # デバッグ用にデータを出力
+        try:
+            self.handle_json(json.loads(data))
+        except json.JSONDecodeError:
+            print("[!] JSON Decode Error: Invalid JSON format.")
+
+    def handle_json(self, received_json):
+        """ デコード済みの JSON からゲーム状態を取り出して処理する """
+        try:
+            if not isinstance(received_json, dict):  # JSONが辞書型でない場合エラー
+                raise ValueError("Received JSON is not a dictionary.")
+
+            # is_game_active の取得
+            is_game_active = received_json.get("is_game_active")
+            print(f"[*] Game Status Received: is_game_active = {is_game_active}")
+
+            # 受信データに基づいて処理を実行
+            self.process_game_status(is_game_active)
+
+        except ValueError as e:
+            print(f"[!] Value Error: {e}")
 
     def process_game_status(self, is_game_active):
-        """ 受信したゲームの状態に応じて .env ファイルを書き換える """
+        """ 受信したゲームの状態をメモリ上の GameState に反映する """
         if is_game_active is True:
             print("[+] ゲームが開始されました！")
-            self.update_env("GAME_STATUS", "ACTIVE")  # ゲーム開始
+            status = GameState.ACTIVE  # ゲーム開始
         elif is_game_active is False:
             print("[-] ゲームが終了しました。")
-            self.update_env("GAME_STATUS", "INACTIVE")  # ゲーム終了
+            status = GameState.INACTIVE  # ゲーム終了
         else:
             print("[!] 受信データが正しくありません。")
+            return
+
+        if self.game_state.set(status):
+            self.schedule_env_write()
+
+    def schedule_env_write(self):
+        """ 最後の状態変化から ENV_WRITE_DEBOUNCE 秒後に一度だけ .env を書き換える """
+        if not self.env_path:
+            return
+        if self._env_write_handle is not None:
+            self._env_write_handle.cancel()
+        self._env_write_handle = self.loop.call_later(config.ENV_WRITE_DEBOUNCE, self._write_env)
+
+    def _write_env(self):
+        self._env_write_handle = None
+        status, _ = self.game_state.get()
+        # ファイル書き込みでイベントループを止めない
+        self.loop.run_in_executor(None, self.update_env, "GAME_STATUS", status)
 
     def update_env(self, key, value):
         """ .env ファイル内の指定キーの値を更新する """
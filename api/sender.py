@@ -1,30 +1,46 @@
 import json
+import queue
 import socket
+import threading
+import time
 
 from config import config
+from metrics import metrics
 
 
 class SenderTCP:
-    def __init__(self):
+    def __init__(self, async_mode=None):
         """
         TCPクライアントを初期化
 
-        :param server_ip: サーバーのIPアドレス (MacBookのIP)
-        :param server_port: サーバーのポート番号
-        :param buffer_size: 受信バッファサイズ（デフォルト4096）
+        :param async_mode: True の場合はバックグラウンドのワーカーが持続的な接続で送信する (省略時は config.SENDER_ASYNC)
         """
         self.server_ip = config.SERVER_IP
         self.server_port = config.SERVER_PORT
         self.buffer_size = config.BUFFER_SIZE
+        self.async_mode = config.SENDER_ASYNC if async_mode is None else async_mode
 
-    def send_request(self,type:str, uuid: str, machine_id: int):
-        """
-        サーバーにUUIDとmachine_idを送信する
+        self.queue = queue.Queue(maxsize=config.SENDER_QUEUE_SIZE)
+        self.client = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._worker = None
 
-        :param uuid: 送信するアクターのUUID
-        :param machine_id: 送信する機械のID (0~3)
-        :return: サーバーからのレスポンス
-        """
+        # 送信状況のカウンタ
+        self.sent_events = 0
+        self.failed_events = 0
+        self.dropped_events = 0
+        self.reconnects = 0  # 接続が切れた後に接続し直した回数 (最初の接続は含まない)
+        self._has_connected = False
+        self.last_latency = None  # キューに入れてから送信完了までの秒数
+        self.max_latency = 0.0
+
+        if self.async_mode:
+            self._worker = threading.Thread(target=self._worker_loop, name="SenderTCP", daemon=True)
+            self._worker.start()
+
+    def _build_message(self, type: str, uuid: str, machine_id: int):
+        """送信する JSON を改行区切りのメッセージにエンコードする"""
         if not (0 <= machine_id <= 3):
             raise ValueError("machine_id は 0~3 の範囲で指定してください。")
 
@@ -41,11 +57,46 @@ class SenderTCP:
                 "type" : type
             }
 
-        # JSONデータをエンコード
-        send_str = json.dumps(data, separators=(",", ":"))
+        # JSONデータをエンコード (1行1メッセージ)
+        return (json.dumps(data, separators=(",", ":")) + "\n").encode()
+
+    def send_request(self,type:str, uuid: str, machine_id: int):
+        """
+        サーバーにUUIDとmachine_idを送信する
+
+        非同期モードではキューに入れてすぐに戻る。キューが一杯の場合は最も古いイベントを捨てる。
+
+        :param uuid: 送信するアクターのUUID
+        :param machine_id: 送信する機械のID (0~3)
+        """
+        start = time.perf_counter()
+        message = self._build_message(type, uuid, machine_id)
+
+        if not self.async_mode:
+            self._send_once(message, machine_id)
+            metrics.observe("send", time.perf_counter() - start, camera=machine_id)
+            return
 
+        item = (message, start, machine_id)
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                break
+            except queue.Full:
+                try:
+                    _, _, dropped_machine_id = self.queue.get_nowait()
+                    with self._lock:
+                        self.dropped_events += 1
+                    metrics.inc("events_dropped", camera=dropped_machine_id)
+                except queue.Empty:
+                    pass
+        metrics.observe("send", time.perf_counter() - start, camera=machine_id)
+
+    def _send_once(self, message, machine_id):
+        """接続ごとに1メッセージを送信する (同期モード)"""
         # TCPソケットを作成
         client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(config.SENDER_TIMEOUT)
 
         try:
             # サーバーに接続
@@ -53,14 +104,136 @@ class SenderTCP:
             print(f"📡 Sending data to {self.server_ip}:{self.server_port} ...")
 
             # JSONデータを送信
-            client.send(send_str.encode())
+            client.sendall(message)
 
             # サーバーからのレスポンスを受信
             response = client.recv(self.buffer_size)
             print("✅ Server Response:", response.decode())
+            with self._lock:
+                self.sent_events += 1
+            metrics.inc("events_sent", camera=machine_id)
 
         except Exception as e:
             print("❌ Error:", e)
+            with self._lock:
+                self.failed_events += 1
+            metrics.inc("send_failures", camera=machine_id)
 
         finally:
             client.close()  # 接続を閉じる
+
+    def _worker_loop(self):
+        """キューからイベントを取り出して送信し続ける"""
+        while not self._stop_event.is_set():
+            try:
+                message, enqueued_at, machine_id = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._deliver(message, enqueued_at, machine_id)
+
+    def _deliver(self, message, enqueued_at, machine_id):
+        """再接続とバックオフ付きでメッセージを1つ送信する"""
+        backoff = config.SENDER_BACKOFF_INITIAL
+        for attempt in range(config.SENDER_MAX_RETRIES + 1):
+            try:
+                self._ensure_connected()
+                self.client.sendall(message)
+                self._read_response()
+
+                latency = time.perf_counter() - enqueued_at
+                with self._lock:
+                    self.sent_events += 1
+                    self.last_latency = latency
+                    self.max_latency = max(self.max_latency, latency)
+                metrics.inc("events_sent", camera=machine_id)
+                metrics.observe("send_latency", latency, camera=machine_id)
+                return
+            except OSError as e:
+                print(f"❌ Error (attempt {attempt + 1}): {e}")
+                self._close_connection()
+                if self._stop_event.wait(backoff):
+                    break
+                backoff = min(backoff * 2, config.SENDER_BACKOFF_MAX)
+
+        with self._lock:
+            self.failed_events += 1
+        metrics.inc("send_failures", camera=machine_id)
+
+    def _ensure_connected(self):
+        """接続がなければ、またはサーバー側で閉じられていれば接続し直す"""
+        if self.client is not None and not self._is_connection_alive():
+            self._close_connection()
+
+        if self.client is None:
+            self.client = socket.create_connection(
+                (self.server_ip, self.server_port), timeout=config.SENDER_CONNECT_TIMEOUT
+            )
+            self.client.settimeout(config.SENDER_TIMEOUT)
+            self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self._has_connected:
+                with self._lock:
+                    self.reconnects += 1
+            self._has_connected = True
+            print(f"🔌 Connected to {self.server_ip}:{self.server_port}")
+
+    def _is_connection_alive(self):
+        """読み捨てずに覗き見て、相手が接続を閉じていないかを確認する"""
+        try:
+            self.client.setblocking(False)
+            return self.client.recv(1, socket.MSG_PEEK) != b""
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            if self.client is not None:
+                self.client.settimeout(config.SENDER_TIMEOUT)
+
+    def _read_response(self):
+        """サーバーからのレスポンスを受信する。相手が閉じた場合やタイムアウトした場合は次回再接続する"""
+        if not config.SENDER_WAIT_RESPONSE:
+            return
+        try:
+            response = self.client.recv(self.buffer_size)
+        except socket.timeout:
+            # 遅れて届いたレスポンスを次のイベントへのレスポンスとして読まないように、接続を捨てる
+            print("⚠️ No response from server, reconnecting for the next event.")
+            self._close_connection()
+            return
+
+        if response:
+            print("✅ Server Response:", response.decode(errors="replace").strip())
+        else:
+            self._close_connection()
+
+    def _close_connection(self):
+        if self.client is not None:
+            try:
+                self.client.close()
+            except OSError:
+                pass
+            self.client = None
+
+    def stats(self):
+        """キューの深さと送信状況を返す"""
+        with self._lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "sent": self.sent_events,
+                "failed": self.failed_events,
+                "dropped": self.dropped_events,
+                "reconnects": self.reconnects,
+                "last_latency": self.last_latency,
+                "max_latency": self.max_latency,
+            }
+
+    def close(self, timeout=1.0):
+        """ワーカーを止めて接続を閉じる。キューに残ったイベントは timeout 秒まで送信を待つ"""
+        if self._worker is not None:
+            deadline = time.perf_counter() + timeout
+            while not self.queue.empty() and time.perf_counter() < deadline:
+                time.sleep(0.01)
+            self._stop_event.set()
+            self._worker.join(timeout=timeout)
+            self._worker = None
+        self._close_connection()
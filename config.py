@@ -10,17 +10,172 @@ class Config:
     # Camera settings
     FRAME_WIDTH = int(os.getenv("FRAME_WIDTH", 640))
     FRAME_HEIGHT = int(os.getenv("FRAME_HEIGHT", 480))
+    CAMERA_THREADED = os.getenv("CAMERA_THREADED", "true").lower() == "true"
+    CAMERA_BUFFER_SIZE = int(os.getenv("CAMERA_BUFFER_SIZE", 1)) # 0 の場合はドライバの既定値
+    CAMERA_FOURCC = os.getenv("CAMERA_FOURCC", "MJPG") # 空の場合は設定しない
+    CAMERA_STALL_TIMEOUT = float(os.getenv("CAMERA_STALL_TIMEOUT", 3.0)) # seconds (この間フレームがなければ再接続)
+    CAMERA_RECONNECT_INITIAL = float(os.getenv("CAMERA_RECONNECT_INITIAL", 0.5)) # seconds
+    CAMERA_RECONNECT_MAX = float(os.getenv("CAMERA_RECONNECT_MAX", 30.0)) # seconds
 
     # Device settings
     DEVICE = os.getenv("DEVICE", "cuda" if os.getenv("USE_CUDA", "true").lower() == "true" else "cpu")
 
+    # Model settings
+    MODEL_NAME = os.getenv("MODEL_NAME", "buffalo_l")
+    MODEL_ROOT = os.getenv("MODEL_ROOT", "~/.insightface")
+    DET_MODEL_FILE = os.getenv("DET_MODEL_FILE", "det_10g.onnx") # SCRFD のモデル (scrfd_2.5g_bnkps.onnx など) も指定できる
+    DET_BACKEND = os.getenv("DET_BACKEND", "insightface") # insightface / int8 / yunet
+    DET_INT8_MODEL_FILE = os.getenv("DET_INT8_MODEL_FILE", "det_10g_int8.onnx")
+    YUNET_MODEL_PATH = os.getenv("YUNET_MODEL_PATH", "~/.insightface/models/face_detection_yunet_2023mar.onnx")
+    YUNET_NMS_THRESH = float(os.getenv("YUNET_NMS_THRESH", 0.3))
+    REC_MODEL_FILE = os.getenv("REC_MODEL_FILE", "w600k_r50.onnx")
+    DETECTION_ONLY = os.getenv("DETECTION_ONLY", "true").lower() == "true"
+    DET_SIZE = tuple(int(v) for v in os.getenv("DET_SIZE", "640,640").split(",")) # width,height
+    DET_THRESH = float(os.getenv("DET_THRESH", 0.5))
+    DET_ADAPTIVE_SIZE = os.getenv("DET_ADAPTIVE_SIZE", "true").lower() == "true"
+    DET_MIN_FACE_PX = int(os.getenv("DET_MIN_FACE_PX", 32)) # 縮小後の最小の顔の大きさ
+    DET_BATCH_SIZE = int(os.getenv("DET_BATCH_SIZE", 1)) # 2以上の場合は複数カメラのフレームをまとめて推論する
+    DET_BATCH_MAX_WAIT = float(os.getenv("DET_BATCH_MAX_WAIT", 0.005)) # seconds
+
+    # ONNX Runtime / CPU settings
+    ORT_INTRA_THREADS = int(os.getenv("ORT_INTRA_THREADS", 0)) # 0 の場合はカメラの台数でコアを分けて決める
+    ORT_INTER_THREADS = int(os.getenv("ORT_INTER_THREADS", 1))
+    ORT_GRAPH_OPT_LEVEL = os.getenv("ORT_GRAPH_OPT_LEVEL", "all") # disable / basic / extended / all
+    ORT_CPU_MEM_ARENA = os.getenv("ORT_CPU_MEM_ARENA", "true").lower() == "true"
+    ORT_MEM_PATTERN = os.getenv("ORT_MEM_PATTERN", "true").lower() == "true"
+    ORT_ALLOW_SPINNING = os.getenv("ORT_ALLOW_SPINNING", "false").lower() == "true"
+    ORT_CACHE_DIR = os.getenv("ORT_CACHE_DIR", "~/.cache/visioncraft/ort") # 空の場合は最適化済みモデルを保存しない
+    WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true" # 起動時にダミーのフレームで推論しておく
+    CPU_AFFINITY = os.getenv("CPU_AFFINITY", "") # 空: 固定しない / auto: 担当カメラの分のコア / "0-3,6": 指定したコア
+    CPU_RESERVED_CORES = int(os.getenv("CPU_RESERVED_CORES", 1)) # 検出モデルに使わせないコア数
+
     # Server settings
     SERVER_IP = os.getenv("SERVER_IP", "127.0.0.1")
     SERVER_PORT = int(os.getenv("SERVER_PORT", 8080))
     BUFFER_SIZE = int(os.getenv("BUFFER_SIZE", 4096))
+    SENDER_ASYNC = os.getenv("SENDER_ASYNC", "true").lower() == "true"
+    SENDER_QUEUE_SIZE = int(os.getenv("SENDER_QUEUE_SIZE", 32))
+    SENDER_CONNECT_TIMEOUT = float(os.getenv("SENDER_CONNECT_TIMEOUT", 2.0)) # seconds
+    SENDER_TIMEOUT = float(os.getenv("SENDER_TIMEOUT", 2.0)) # seconds
+    SENDER_WAIT_RESPONSE = os.getenv("SENDER_WAIT_RESPONSE", "true").lower() == "true"
+    SENDER_MAX_RETRIES = int(os.getenv("SENDER_MAX_RETRIES", 3))
+    SENDER_BACKOFF_INITIAL = float(os.getenv("SENDER_BACKOFF_INITIAL", 0.1)) # seconds
+    SENDER_BACKOFF_MAX = float(os.getenv("SENDER_BACKOFF_MAX", 5.0)) # seconds
+
+    # Receiver settings
+    RECEIVER_ENABLED = os.getenv("RECEIVER_ENABLED", "true").lower() == "true"
+    RECEIVER_HOST = os.getenv("RECEIVER_HOST", "127.0.0.1")
+    RECEIVER_PORT = int(os.getenv("RECEIVER_PORT", 3035))
+    RECEIVER_BUFFER_SIZE = int(os.getenv("RECEIVER_BUFFER_SIZE", 1024))
+    RECEIVER_MAX_MESSAGE_SIZE = int(os.getenv("RECEIVER_MAX_MESSAGE_SIZE", 65536))
+    GAME_STATUS = os.getenv("GAME_STATUS", "INACTIVE")
+    ENV_PATH = os.getenv("ENV_PATH", "./common/.env") # 空の場合は .env に書き込まない
+    ENV_WRITE_DEBOUNCE = float(os.getenv("ENV_WRITE_DEBOUNCE", 1.0)) # seconds
+    GAME_ACTIVE_MODE = os.getenv("GAME_ACTIVE_MODE", "pause") # pause / duty
+    GAME_ACTIVE_INTERVAL = float(os.getenv("GAME_ACTIVE_INTERVAL", 1.0)) # seconds (duty の場合)
 
     # Identification settings
     FACE_SIZE_THRESHOLD = int(os.getenv("FACE_SIZE_THRESHOLD", 10000))
-    FACE_PERSIST_THRESHOLD = int(os.getenv("FACE_PERSIST_THRESHOLD", 1.5)) # seconds
+    FACE_PERSIST_THRESHOLD = float(os.getenv("FACE_PERSIST_THRESHOLD", 1.5)) # seconds
+    FACE_SIZE_HYSTERESIS = float(os.getenv("FACE_SIZE_HYSTERESIS", 0.8)) # 大きい顔が小さいとみなされるまでの比率
+    EVENT_COOLDOWN = float(os.getenv("EVENT_COOLDOWN", 10.0)) # seconds (同じ人に再び送信するまでの間隔)
+
+    # Region of interest settings (ROI_0 のようにカメラ別に上書き可能)
+    ROI = os.getenv("ROI", "") # x,y,w,h (空の場合はフレーム全体)
+    MIN_FACE_SIZE = int(os.getenv("MIN_FACE_SIZE", 0)) # px (0 の場合は縮小しない)
+
+    # Tracking settings
+    TRACKING_ENABLED = os.getenv("TRACKING_ENABLED", "true").lower() == "true"
+    DETECT_INTERVAL = int(os.getenv("DETECT_INTERVAL", 5)) # frames
+    TRACK_MIN_CONFIDENCE = float(os.getenv("TRACK_MIN_CONFIDENCE", 0.6))
+    TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", 0.3))
+    TRACK_GRACE_FRAMES = int(os.getenv("TRACK_GRACE_FRAMES", 3)) # 検出で見つからなくてもトラックを残す回数
+
+    # Motion gate settings (MOTION_PIXEL_THRESHOLD_0 のようにカメラ別に上書き可能)
+    MOTION_GATE_ENABLED = os.getenv("MOTION_GATE_ENABLED", "false").lower() == "true"
+    MOTION_PIXEL_THRESHOLD = float(os.getenv("MOTION_PIXEL_THRESHOLD", 25))
+    MOTION_AREA_RATIO = float(os.getenv("MOTION_AREA_RATIO", 0.01))
+    MOTION_HOLD_TIME = float(os.getenv("MOTION_HOLD_TIME", 2.0)) # seconds
+    MOTION_SCALE_WIDTH = int(os.getenv("MOTION_SCALE_WIDTH", 160))
+    MOTION_BG_ALPHA = float(os.getenv("MOTION_BG_ALPHA", 0.05))
+
+    # Face quality settings (QUALITY_MIN_SHARPNESS_0 のようにカメラ別に上書き可能)
+    QUALITY_GATE_ENABLED = os.getenv("QUALITY_GATE_ENABLED", "true").lower() == "true"
+    QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", 30)) # 64×64 に縮小した顔のラプラシアンの分散
+    QUALITY_MAX_YAW = float(os.getenv("QUALITY_MAX_YAW", 0.35)) # 鼻のずれ / 目の間隔
+    QUALITY_MAX_PITCH = float(os.getenv("QUALITY_MAX_PITCH", 0.25)) # 鼻の上下のずれ / 目と口の距離
+    QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", 40))
+    QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", 220))
+    QUALITY_MIN_DET_SCORE = float(os.getenv("QUALITY_MIN_DET_SCORE", 0.6))
+    QUALITY_WINDOW = float(os.getenv("QUALITY_WINDOW", 0.5)) # seconds (最良の顔を選ぶ期間)
+
+    # Recognition settings
+    RECOGNITION_ENABLED = os.getenv("RECOGNITION_ENABLED", "false").lower() == "true"
+    DEFAULT_USER_ID = os.getenv("DEFAULT_USER_ID", "hello") # 認識が無効・失敗した場合の user_id
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "qdrant") # qdrant / numpy
+    QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
+    QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
+    QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "faces")
+    NUMPY_INDEX_PATH = os.getenv("NUMPY_INDEX_PATH", "faces.npz")
+    EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 512))
+    RECOGNITION_THRESHOLD = float(os.getenv("RECOGNITION_THRESHOLD", 0.4)) # cosine similarity
+    RECOGNITION_TIMEOUT = float(os.getenv("RECOGNITION_TIMEOUT", 1.0)) # seconds
+    RECOGNITION_CACHE_SIZE = int(os.getenv("RECOGNITION_CACHE_SIZE", 256))
+    RECOGNITION_CACHE_TTL = float(os.getenv("RECOGNITION_CACHE_TTL", 600)) # seconds
+    RECOGNITION_BATCH_SIZE = int(os.getenv("RECOGNITION_BATCH_SIZE", 8))
+    RECOGNITION_MAX_WAIT = float(os.getenv("RECOGNITION_MAX_WAIT", 0.01)) # seconds
+
+    # Metrics settings
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 9100)) # 0 の場合は空いているポート
+    METRICS_HTTP_ENABLED = os.getenv("METRICS_HTTP_ENABLED", "true").lower() == "true"
+    METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", 60.0)) # seconds (0 の場合は出力しない)
+
+    # Preview settings
+    PREVIEW_MODE = os.getenv("PREVIEW_MODE", "window") # window / mjpeg / none (ヘッドレス)
+    PREVIEW_FPS = float(os.getenv("PREVIEW_FPS", 10.0)) # カメラごとの最大表示フレームレート
+    PREVIEW_WIDTH = int(os.getenv("PREVIEW_WIDTH", 320)) # 表示する幅 (0 の場合は縮小しない)
+    PREVIEW_HOST = os.getenv("PREVIEW_HOST", "127.0.0.1")
+    PREVIEW_PORT = int(os.getenv("PREVIEW_PORT", 8090))
+    PREVIEW_JPEG_QUALITY = int(os.getenv("PREVIEW_JPEG_QUALITY", 70))
+
+    # Frame bus settings
+    FRAME_BUS = os.getenv("FRAME_BUS", "off") # off / spawn (キャプチャを子プロセスで実行) / attach (frame_bus.py に接続)
+    FRAME_BUS_SLOTS = int(os.getenv("FRAME_BUS_SLOTS", 8)) # カメラごとのリングのスロット数
+    FRAME_BUS_PREFIX = os.getenv("FRAME_BUS_PREFIX", "visioncraft_cam")
+    FRAME_BUS_ATTACH_TIMEOUT = float(os.getenv("FRAME_BUS_ATTACH_TIMEOUT", 10.0)) # seconds
+
+    # Frame-rate governor settings
+    GOVERNOR_ENABLED = os.getenv("GOVERNOR_ENABLED", "true").lower() == "true"
+    GOVERNOR_TARGET_LATENCY = float(os.getenv("GOVERNOR_TARGET_LATENCY", 0.2)) # seconds (キャプチャから処理完了まで)
+    GOVERNOR_UTILIZATION = float(os.getenv("GOVERNOR_UTILIZATION", 0.9)) # 全カメラで使う処理時間の割合
+    GOVERNOR_MIN_FPS = float(os.getenv("GOVERNOR_MIN_FPS", 2.0))
+    GOVERNOR_MAX_FPS = float(os.getenv("GOVERNOR_MAX_FPS", 30.0))
+    GOVERNOR_MIN_SCALE = float(os.getenv("GOVERNOR_MIN_SCALE", 0.5)) # 検出の入力を縮小する下限
+    GOVERNOR_FACE_WEIGHT = float(os.getenv("GOVERNOR_FACE_WEIGHT", 4.0)) # 顔が見えているカメラの割合の重み
+    GOVERNOR_FACE_HOLD = float(os.getenv("GOVERNOR_FACE_HOLD", 2.0)) # seconds (顔が消えてから優先をやめるまで)
+    GOVERNOR_UPDATE_INTERVAL = float(os.getenv("GOVERNOR_UPDATE_INTERVAL", 0.5)) # seconds
+
+    # Journal settings
+    JOURNAL_ENABLED = os.getenv("JOURNAL_ENABLED", "false").lower() == "true"
+    JOURNAL_DIR = os.getenv("JOURNAL_DIR", "./journal")
+    JOURNAL_RECORD_EMPTY = os.getenv("JOURNAL_RECORD_EMPTY", "false").lower() == "true" # 顔のないフレームも記録する
+    JOURNAL_QUEUE_SIZE = int(os.getenv("JOURNAL_QUEUE_SIZE", 4096)) # 超えた分は捨てる
+    JOURNAL_MAX_BYTES = int(os.getenv("JOURNAL_MAX_BYTES", 64 * 2**20)) # 1ファイルの大きさ
+    JOURNAL_MAX_FILES = int(os.getenv("JOURNAL_MAX_FILES", 50)) # 残すファイルの数
+
+    # Runner settings
+    CAMERA_MAP = os.getenv("CAMERA_MAP", "4:0,2:1,5:2,3:3") # camera_index:machine_id、auto の場合はカメラを探して決める
+    CAMERA_MAP_FALLBACK = os.getenv("CAMERA_MAP_FALLBACK", "4:0,2:1,5:2,3:3") # auto に対応していない OS で使う対応
+    CAMERA_DEVICE_MAP_PATH = os.getenv("CAMERA_DEVICE_MAP_PATH", "camera_devices.json") # stable_id → machine_id の保存先
+    CAMERA_PROBE_MAX = int(os.getenv("CAMERA_PROBE_MAX", 10)) # デバイスを列挙できない OS で確認するインデックスの数
+    FPS_REPORT_INTERVAL = float(os.getenv("FPS_REPORT_INTERVAL", 5.0)) # seconds
+
+    def per_camera(self, name, machine_id):
+        """カメラ別の設定 (例: NAME_0) があればそれを、なければ共通の設定値を返す"""
+        default = getattr(self, name)
+        value = os.getenv(f"{name}_{machine_id}")
+        return default if value is None else type(default)(value)
 
 config = Config()
\ No newline at end of file
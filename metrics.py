@@ -0,0 +1,211 @@
+import bisect
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from config import config
+
+# 処理中のカメラ (machine_id)。FaceIdentification が1フレームの処理の間だけ設定する
+current_camera = contextvars.ContextVar("current_camera", default="")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """累積のバケット数と、直近の値の分位点を求めるための一定数の履歴を持つヒストグラム"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1024):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, q):
+        return float(np.percentile(self.recent, q)) if self.recent else 0.0
+
+
+class Metrics:
+    """カメラ別のカウンタとヒストグラムを集計し、Prometheus 形式とログで公開するクラス"""
+
+    def __init__(self, enabled=True, prefix="visioncraft"):
+        """
+        :param enabled: False の場合はすべての記録を何もせずに返す
+        :param prefix: Prometheus のメトリクス名の接頭辞
+        """
+        self.enabled = enabled
+        self.prefix = prefix
+        self.counters = {}  # (name, camera) -> value
+        self.histograms = {}  # (name, camera) -> Histogram
+        self.gauges = {}  # name -> callback() -> {camera: value}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @contextmanager
+    def camera(self, label):
+        """ブロック内で記録する値のカメララベルを設定する"""
+        token = current_camera.set(str(label))
+        try:
+            yield
+        finally:
+            current_camera.reset(token)
+
+    def inc(self, name, value=1, camera=None):
+        """カウンタを増やす"""
+        if not self.enabled:
+            return
+        key = (name, current_camera.get() if camera is None else str(camera))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, camera=None):
+        """処理時間 (秒) をヒストグラムに記録する"""
+        if not self.enabled:
+            return
+        key = (name, current_camera.get() if camera is None else str(camera))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def gauge(self, name, callback):
+        """公開時に callback() を呼び出して {camera: value} を取得するゲージを登録する"""
+        self.gauges[name] = callback
+
+    def render_prometheus(self):
+        """Prometheus のテキスト形式で全メトリクスを返す"""
+        lines = []
+        with self._lock:
+            # ロックの外で整形できるように値を写しておく
+            counters = sorted(self.counters.items())
+            histograms = [
+                (key, (list(h.counts), h.sum, h.count, h.buckets))
+                for key, h in sorted(self.histograms.items())
+            ]
+
+        typed = set()
+        for (name, camera), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f'{metric}{{camera="{camera}"}} {value}')
+
+        for (name, camera), (counts, total, count, buckets) in histograms:
+            metric = f"{self.prefix}_{name}_seconds"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{camera="{camera}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{camera="{camera}"}} {total}')
+            lines.append(f'{metric}_count{{camera="{camera}"}} {count}')
+
+        for name, callback in sorted(self.gauges.items()):
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            for camera, value in callback().items():
+                lines.append(f'{metric}{{camera="{camera}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """ログ用に各処理の直近の p50/p95 と回数をまとめる"""
+        with self._lock:
+            parts = [
+                f"{name}[{camera}] p50 {h.percentile(50) * 1000:.1f}ms p95 {h.percentile(95) * 1000:.1f}ms n={h.count}"
+                for (name, camera), h in sorted(self.histograms.items())
+            ]
+            parts += [f"{name}[{camera}] {value}" for (name, camera), value in sorted(self.counters.items())]
+        return " | ".join(parts)
+
+    def start_http_server(self, host=None, port=None):
+        """メトリクスを返す HTTP サーバーを別スレッドで起動する"""
+        if not self.enabled:
+            return None
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        host = host or config.METRICS_HOST
+        port = config.METRICS_PORT if port is None else port
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="Metrics", daemon=True).start()
+        print(f"📊 Metrics available at http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server
+
+    def start_log_summary(self, interval=None):
+        """interval 秒ごとに summary() をログに出力するスレッドを起動する"""
+        interval = config.METRICS_LOG_INTERVAL if interval is None else interval
+        if not self.enabled or interval <= 0:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                print(f"📊 Metrics | {self.summary()}")
+
+        threading.Thread(target=loop, name="MetricsLog", daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+class StartupTimer:
+    """起動の各段階の所要時間を計測し、ログに出力する"""
+
+    def __init__(self):
+        # 最初に import された時点 (ほぼプロセスの開始時) から数える
+        self.start = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases.append((name, elapsed))
+            print(f"⏱️ {name}: {elapsed:.2f}s")
+
+    def report(self):
+        """起動全体の所要時間と内訳を出力し、合計秒数を返す"""
+        total = time.perf_counter() - self.start
+        other = total - sum(elapsed for _, elapsed in self.phases)
+        breakdown = ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in self.phases + [("other", other)])
+        print(f"⏱️ Startup finished in {total:.2f}s ({breakdown})")
+        metrics.observe("startup", total, camera="all")
+        return total
+
+
+metrics = Metrics(config.METRICS_ENABLED)
+startup = StartupTimer()
@@ -6,9 +6,6 @@ call .\.venv\Scripts\activate
 set PYTHONPATH=%CD%
 echo PYTHONPATH is set to %PYTHONPATH%
 
-echo Opening Windows Terminal with multiple tabs...
+echo Starting multi-camera identification...
 
-wt new-tab -p "PowerShell" -d . --title "Camera00" cmd /k python ./src/identify00.py ^
-    ; new-tab -p "PowerShell" -d . --title "Camera01" cmd /k python ./src/identify01.py ^
-    ; new-tab -p "PowerShell" -d . --title "Camera02" cmd /k python ./src/identify02.py ^
-    ; new-tab -p "PowerShell" -d . --title "Camera03" cmd /k python ./src/identify03.py ^
\ No newline at end of file
+python ./src/runner.py %*
@@ -0,0 +1,324 @@
+import argparse
+import json
+import os
+import platform
+import socketserver
+import threading
+import time
+
+import numpy as np
+
+from api.sender import SenderTCP
+from config import config
+from cpu_budget import session_options
+from detection import FaceDetector
+from identification import FaceIdentification
+from sources import open_source
+from tracking import iou
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class _StubHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            with self.server.lock:
+                self.server.events.append(json.loads(line))
+            self.wfile.write(b'{"status":"ok"}\n')
+
+
+class StubGameServer(socketserver.ThreadingTCPServer):
+    """受信したイベントを記録するだけのゲームサーバーの代わり"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _StubHandler)
+        self.events = []
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="StubGameServer", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def memory_usage():
+    """現在と最大の RSS (MB) を返す。取得できない値は None"""
+    rss = psutil.Process().memory_info().rss / 2**20 if psutil is not None else None
+    peak = None
+    if resource is not None:
+        # Linux では KB、macOS では byte 単位
+        scale = 2**20 if platform.system() == "Darwin" else 2**10
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    return rss, peak
+
+
+def summarize(name, stage, latencies, wall_time, cpu_time, **extra):
+    """計測結果を JSON に書き出せる辞書にまとめる"""
+    latencies = np.asarray(latencies) * 1000
+    rss, peak = memory_usage()
+    result = {
+        "source": name,
+        "stage": stage,
+        "frames": int(latencies.size),
+        "fps": latencies.size / wall_time if wall_time > 0 else 0.0,
+        "latency_ms": {
+            "mean": float(latencies.mean()) if latencies.size else None,
+            "p50": float(np.percentile(latencies, 50)) if latencies.size else None,
+            "p90": float(np.percentile(latencies, 90)) if latencies.size else None,
+            "p99": float(np.percentile(latencies, 99)) if latencies.size else None,
+            "max": float(latencies.max()) if latencies.size else None,
+        },
+        "cpu_time": cpu_time,
+        "cpu_percent": cpu_time / wall_time * 100 if wall_time > 0 else 0.0,
+        "rss_mb": rss,
+        "peak_rss_mb": peak,
+    }
+    result.update(extra)
+    return result
+
+
+def replay(source, handle_frame, max_frames=None):
+    """ソースのフレームを順に handle_frame に渡し、1フレームごとの処理時間を計測する"""
+    latencies = []
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    while not source.exhausted and (max_frames is None or len(latencies) < max_frames):
+        frame = source.get_frame()
+        if frame is None:
+            if source.realtime:
+                time.sleep(0.001)
+            continue
+        start = time.perf_counter()
+        handle_frame(frame)
+        latencies.append(time.perf_counter() - start)
+    return latencies, time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+
+def session_variants(args):
+    """
+    --ort-threads と --ort-opt-levels の組み合わせを返す
+
+    :return: {"intra_threads": ..., "graph_opt_level": ...} のリスト。指定がない場合は config の設定1つ
+    """
+    threads = [int(v) for v in args.ort_threads.split(",")] if args.ort_threads else [config.ORT_INTRA_THREADS]
+    levels = args.ort_opt_levels.split(",") if args.ort_opt_levels else [config.ORT_GRAPH_OPT_LEVEL]
+    return [{"intra_threads": t, "graph_opt_level": level} for t in threads for level in levels]
+
+
+def bench_detector(detector, spec, args):
+    """FaceDetector.detect_face だけを計測する"""
+    source = open_source(spec, realtime=args.realtime)
+    faces = 0
+
+    def handle_frame(frame):
+        nonlocal faces
+        if detector.detect_face(frame) is not None:
+            faces += 1
+
+    try:
+        latencies, wall_time, cpu_time = replay(source, handle_frame, args.frames)
+    finally:
+        source.release()
+    return summarize(str(spec), "detector", latencies, wall_time, cpu_time, faces=faces)
+
+
+def bench_backend(backend, spec, args):
+    """1つの検出バックエンドで各フレームの最も大きい顔を求め、速度と検出結果を返す"""
+    startup = time.perf_counter()
+    detector = FaceDetector(backend=backend)
+    startup = time.perf_counter() - startup
+    source = open_source(spec)
+    faces = []
+
+    def handle_frame(frame):
+        faces.append(detector.detect_face(frame))
+
+    try:
+        latencies, wall_time, cpu_time = replay(source, handle_frame, args.frames)
+    finally:
+        source.release()
+    result = summarize(str(spec), "backend", latencies, wall_time, cpu_time, backend=backend, startup_sec=startup)
+    return result, faces
+
+
+def is_trigger(face):
+    """FaceIdentification と同じ基準で、送信の対象になる大きさの顔かどうかを返す"""
+    if face is None:
+        return False
+    x1, y1, x2, y2 = face
+    return (x2 - x1) * (y2 - y1) > config.FACE_SIZE_THRESHOLD
+
+
+def compare_faces(reference, faces):
+    """
+    基準のバックエンドの結果と比べた一致度を返す
+
+    :return: 顔の有無の一致率、FACE_SIZE_THRESHOLD を超える顔 (送信のきっかけ) の再現率・適合率、枠の平均 IoU
+    """
+    frames = min(len(reference), len(faces))
+    detected = sum((a is not None) == (b is not None) for a, b in zip(reference, faces))
+    ref_triggers = [is_trigger(face) for face in reference[:frames]]
+    triggers = [is_trigger(face) for face in faces[:frames]]
+    both = sum(a and b for a, b in zip(ref_triggers, triggers))
+    ious = [iou(a, b) for a, b in zip(reference, faces) if a is not None and b is not None]
+    return {
+        "detection_agreement": detected / frames if frames else None,
+        "trigger_recall": both / sum(ref_triggers) if any(ref_triggers) else None,
+        "trigger_precision": both / sum(triggers) if any(triggers) else None,
+        "mean_iou": float(np.mean(ious)) if ious else None,
+    }
+
+
+def bench_backends(spec, args):
+    """
+    検出バックエンドごとの速度と、最初のバックエンドを基準にした精度を比較する
+
+    録画した映像を全フレーム同じ順に再生するので、realtime は使わない。
+    """
+    results = []
+    reference = None
+    for backend in args.backends.split(","):
+        try:
+            result, faces = bench_backend(backend, spec, args)
+        except (RuntimeError, ValueError) as e:
+            print(f"⚠️ Skipped backend {backend}: {e}")
+            continue
+        if reference is None:
+            reference = faces
+            result["reference"] = True
+        result["accuracy"] = compare_faces(reference, faces)
+        results.append(result)
+    return results
+
+
+def bench_pipeline(detector, sender, server, spec, args):
+    """FaceIdentification.process_frame を画面表示なしで計測する"""
+    source = open_source(spec, realtime=args.realtime)
+    ident = FaceIdentification(
+        input_cindex=None, output_cindex=args.machine_id, detector=detector, sender=sender, source=source
+    )
+    events_before = len(server.events)
+    try:
+        latencies, wall_time, cpu_time = replay(source, ident.process_frame, args.frames)
+    finally:
+        ident.release()
+
+    # 非同期送信の残りを待ってからイベント数を数える
+    deadline = time.perf_counter() + 2.0
+    while sender.stats()["queue_depth"] and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    return summarize(
+        str(spec), "pipeline", latencies, wall_time, cpu_time,
+        events=len(server.events) - events_before,
+        sender=sender.stats(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="録画した映像で検出・識別パイプラインの性能を計測する")
+    parser.add_argument("sources", nargs="+", help="動画ファイル、画像ディレクトリ、synthetic[:N] またはカメラ番号")
+    parser.add_argument("--frames", type=int, default=None, help="ソースごとの最大フレーム数")
+    parser.add_argument("--stage", choices=["detector", "pipeline", "both", "backends"], default="both")
+    parser.add_argument("--realtime", action="store_true", help="元の映像のフレームレートで再生する")
+    parser.add_argument("--machine-id", type=int, default=0)
+    parser.add_argument("--output", default="bench_result.json", help="結果を書き出す JSON ファイル")
+    parser.add_argument(
+        "--backends", default="insightface,int8,yunet",
+        help="--stage backends で比較する検出バックエンドのカンマ区切り (最初のものを精度の基準にする)",
+    )
+    parser.add_argument("--ort-threads", default=None, help="比較する intra-op スレッド数のカンマ区切り (例: 1,2,4)")
+    parser.add_argument("--ort-opt-levels", default=None, help="比較するグラフ最適化レベルのカンマ区切り (例: basic,all)")
+    args = parser.parse_args()
+
+    server = StubGameServer().start()
+    config.SERVER_IP, config.SERVER_PORT = "127.0.0.1", server.port
+    sender = SenderTCP()
+
+    results = []
+    startup = None
+    try:
+        if args.stage == "backends":
+            for spec in args.sources:
+                for result in bench_backends(spec, args):
+                    accuracy = {
+                        key: f"{value:.2f}" if value is not None else "-"
+                        for key, value in result["accuracy"].items()
+                    }
+                    print(
+                        f"📊 {result['source']} [{result['backend']}] {result['fps']:.1f} FPS, "
+                        f"p50 {result['latency_ms']['p50'] or 0:.1f}ms, "
+                        f"agreement {accuracy['detection_agreement']}, "
+                        f"trigger recall {accuracy['trigger_recall']} precision {accuracy['trigger_precision']}, "
+                        f"IoU {accuracy['mean_iou']}"
+                    )
+                    results.append(result)
+
+        for variant in session_variants(args) if args.stage != "backends" else []:
+            variant_start = time.perf_counter()
+            detector = FaceDetector(
+                session_options=session_options(variant["intra_threads"], None, variant["graph_opt_level"])
+            )
+            variant["startup_sec"] = time.perf_counter() - variant_start
+            startup = variant["startup_sec"] if startup is None else startup
+
+            for spec in args.sources:
+                source_results = []
+                if args.stage in ("detector", "both"):
+                    source_results.append(bench_detector(detector, spec, args))
+                if args.stage in ("pipeline", "both"):
+                    source_results.append(bench_pipeline(detector, sender, server, spec, args))
+                for result in source_results:
+                    result["ort"] = variant
+                    latency = result["latency_ms"]
+                    print(
+                        f"📊 {result['source']} [{result['stage']}] "
+                        f"threads={variant['intra_threads'] or 'auto'} opt={variant['graph_opt_level']}: "
+                        f"{result['fps']:.1f} FPS, p50 {latency['p50'] or 0:.1f}ms, "
+                        f"p99 {latency['p99'] or 0:.1f}ms, CPU {result['cpu_percent']:.0f}%"
+                    )
+                results.extend(source_results)
+    finally:
+        sender.close()
+        server.stop()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "detector_startup_sec": startup,
+        "config": {
+            key: getattr(config, key)
+            for key in ("DEVICE", "DETECTION_ONLY", "DET_SIZE", "DET_ADAPTIVE_SIZE", "MIN_FACE_SIZE",
+                        "TRACKING_ENABLED", "DETECT_INTERVAL", "MOTION_GATE_ENABLED", "FACE_SIZE_THRESHOLD",
+                        "ORT_INTER_THREADS", "ORT_CPU_MEM_ARENA", "ORT_MEM_PATTERN", "ORT_ALLOW_SPINNING",
+                        "DET_BACKEND", "DET_THRESH")
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    print(f"💾 Saved benchmark results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,271 @@
+import threading
 import time
 
 import cv2
 
 from config import config
+from metrics import metrics
 
 class Camera:
-    def __init__(self, index):
+    def __init__(self, index, threaded=None):
+        """
+        :param index: カメラのインデックス
+        :param threaded: True の場合は別スレッドで常に最新フレームのみを取得する (省略時は config.CAMERA_THREADED)
+        """
         self.index = index
         self.height = config.FRAME_HEIGHT
         self.width = config.FRAME_WIDTH
         self.cap = None
+        self.threaded = config.CAMERA_THREADED if threaded is None else threaded
+        # sources.py の FrameSource と同じ属性 (ライブのカメラは終わらず、実時間で進む)
+        self.exhausted = False
+        self.realtime = True
+
+        # 最新フレームとそのシーケンス番号・取得時刻
+        self.frame = None
+        self.seq = 0
+        self.timestamp = None
+        self.last_read_seq = 0
+
+        # 推論がキャプチャにどれだけ遅れているかを示すカウンタ
+        self.captured_frames = 0
+        self.dropped_frames = 0
+        self.duplicate_frames = 0
+
+        # 切断の検知と再接続の状況
+        self.connected = False
+        self.reconnects = 0
+        self.downtime = 0.0  # 切断していた秒数の合計 (現在の切断中の分は含まない)
+        self.down_since = None
+        self.last_frame_time = time.perf_counter()
+        self._reconnect_thread = None
+
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
         self._init_camera()
-    
+
     def _init_camera(self):
-        self.cap = cv2.VideoCapture(self.index)
-        if self.cap.isOpened():
-            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
-            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self._open_device():
+            if self.threaded:
+                self._start_grabber()
             return
         else:
             raise RuntimeError(f"❌ カメラ {self.index} を開けませんでした。")
-        
 
-    def get_frame(self):
-        if self.cap is None or not self.cap.isOpened():
-            return None
-        
-        ret, frame = self.cap.read()
-        return frame if ret else None
-    
-    def release(self):
+    def _open_device(self):
+        """デバイスを開き、遅延の少ないキャプチャ設定を適用する。開けた場合は True"""
+        cap = cv2.VideoCapture(self.index)
+        if not cap.isOpened():
+            cap.release()
+            return False
+
+        if config.CAMERA_FOURCC:
+            # USB カメラは MJPG の方が高い解像度・フレームレートを出せることが多い (非対応なら無視される)
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*config.CAMERA_FOURCC))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if config.CAMERA_BUFFER_SIZE > 0:
+            # ドライバ側にフレームをためず、常に新しいフレームを読む
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, config.CAMERA_BUFFER_SIZE)
+        if hasattr(cv2, "CAP_PROP_READ_TIMEOUT_MSEC"):
+            # 応答しなくなったデバイスで read() が止まり続けないようにする
+            cap.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, config.CAMERA_STALL_TIMEOUT * 1000)
+
+        self.cap = cap
+        self.connected = True
+        self.last_frame_time = time.perf_counter()
+        return True
+
+    def _start_grabber(self):
+        """フレーム取得スレッドを開始する"""
+        self._thread = threading.Thread(
+            target=self._grab_loop, name=f"Camera{self.index}", daemon=True
+        )
+        self._thread.start()
+
+    def _grab_loop(self):
+        """
+        デバイスから読み続け、最新フレームだけを保持する
+
+        read() の途中で別のスレッドから解放しないように、デバイスはこのスレッドが終了時に解放する。
+        """
+        try:
+            while not self._stop_event.is_set():
+                ret, frame = self.cap.read()
+                if not ret:
+                    if self._is_stalled():
+                        self._reconnect()
+                    else:
+                        self._stop_event.wait(0.01)
+                    continue
+
+                self.last_frame_time = time.perf_counter()
+                with self._condition:
+                    # 前のフレームが読まれる前に上書きされた場合はドロップとして数える
+                    if self.seq > self.last_read_seq:
+                        self.dropped_frames += 1
+                    self.frame = frame
+                    self.seq += 1
+                    self.timestamp = time.time()
+                    self.captured_frames += 1
+                    self._condition.notify_all()
+        finally:
+            self._release_capture()
+
+    def _is_stalled(self):
+        """CAMERA_STALL_TIMEOUT 秒以上フレームを読めていないかを返す"""
+        return time.perf_counter() - self.last_frame_time > config.CAMERA_STALL_TIMEOUT
+
+    def _reconnect(self):
+        """
+        デバイスを閉じ、開けるまで指数バックオフで開き直す
+
+        取得スレッド (同期モードでは再接続用のスレッド) で実行するので、ほかのカメラは止めない。
+        """
+        print(f"⚠️ カメラ {self.index} からフレームを取得できません。再接続します...")
+        self.connected = False
+        self.down_since = time.perf_counter()
         if self.cap is not None:
             self.cap.release()
             self.cap = None
-            print(f"📷 カメラ {self.index} を解放しました。")
\ No newline at end of file
+
+        backoff = config.CAMERA_RECONNECT_INITIAL
+        while not self._stop_event.wait(backoff):
+            if self._open_device():
+                if self._stop_event.is_set():
+                    # 開いている間に release() が呼ばれた (release() はもう解放を終えている)
+                    self._release_capture()
+                    return False
+                downtime = time.perf_counter() - self.down_since
+                self.downtime += downtime
+                self.down_since = None
+                self.reconnects += 1
+                print(f"🔌 カメラ {self.index} に再接続しました ({downtime:.1f}s)")
+                return True
+            backoff = min(backoff * 2, config.CAMERA_RECONNECT_MAX)
+        return False
+
+    def _start_reconnect(self):
+        """同期モードで、再接続をバックグラウンドで開始する"""
+        if self._reconnect_thread is not None and self._reconnect_thread.is_alive():
+            return
+        self.connected = False
+        self._reconnect_thread = threading.Thread(
+            target=self._reconnect, name=f"Camera{self.index}Reconnect", daemon=True
+        )
+        self._reconnect_thread.start()
+
+    def read(self, timeout=0.0):
+        """
+        最新フレームをシーケンス番号・取得時刻と共に返す
+
+        :param timeout: 新しいフレームを待つ最大秒数 (0 の場合は待たない)
+        :return: (frame, seq, timestamp)。新しいフレームがない場合は (None, seq, timestamp)
+        """
+        if not self.threaded:
+            frame = self._get_frame()
+            return frame, self.seq, self.timestamp
+
+        with self._condition:
+            if self.seq == self.last_read_seq and timeout > 0:
+                self._condition.wait_for(lambda: self.seq != self.last_read_seq, timeout)
+
+            if self.seq == self.last_read_seq:
+                # キャプチャより推論の方が速く、前回と同じフレームしかない
+                self.duplicate_frames += 1
+                return None, self.seq, self.timestamp
+
+            self.last_read_seq = self.seq
+            return self.frame, self.seq, self.timestamp
+
+    def get_frame(self):
+        start = time.perf_counter()
+        frame = self._get_frame()
+        metrics.observe("capture", time.perf_counter() - start)
+        if frame is not None:
+            metrics.inc("frames_captured")
+        return frame
+
+    def _get_frame(self):
+        if self.threaded:
+            frame, _, _ = self.read()
+            return frame
+
+        cap = self.cap
+        if not self.connected or cap is None:
+            # 再接続中
+            return None
+
+        ret, frame = cap.read()
+        if not ret:
+            if self._is_stalled():
+                self._start_reconnect()
+            return None
+
+        self.last_frame_time = time.perf_counter()
+        self.seq += 1
+        self.last_read_seq = self.seq
+        self.timestamp = time.time()
+        self.captured_frames += 1
+        return frame
+
+    def grab_into(self, buffer):
+        """
+        次のフレームを buffer (H×W×3 の uint8 配列) に直接書き込む
+
+        サイズが異なるフレームが返った場合は縮小・拡大して書き込む。読めない状態が続く場合は再接続する。
+        :return: 書き込めた場合は True
+        """
+        if not self.connected or self.cap is None:
+            return False
+        ret, frame = self.cap.read(buffer)
+        if not ret:
+            if self._is_stalled():
+                self._reconnect()
+            return False
+        if frame is not buffer:
+            cv2.resize(frame, (buffer.shape[1], buffer.shape[0]), dst=buffer)
+        self.last_frame_time = time.perf_counter()
+        self.seq += 1
+        self.timestamp = time.time()
+        self.captured_frames += 1
+        return True
+
+    def stats(self):
+        """キャプチャ状況のカウンタを返す"""
+        downtime = self.downtime
+        if self.down_since is not None:
+            downtime += time.perf_counter() - self.down_since
+        with self._condition:
+            return {
+                "captured": self.captured_frames,
+                "dropped": self.dropped_frames,
+                "duplicate": self.duplicate_frames,
+                "seq": self.seq,
+                "connected": self.connected,
+                "reconnects": self.reconnects,
+                "downtime": downtime,
+            }
+
+    def _release_capture(self):
+        """デバイスを1回だけ解放する (取得スレッドと release() のどちらから呼ばれてもよい)"""
+        with self._condition:
+            cap, self.cap = self.cap, None
+        if cap is not None:
+            cap.release()
+            print(f"📷 カメラ {self.index} を解放しました。")
+
+    def release(self):
+        self._stop_event.set()
+        # 取得スレッドの read() は CAP_PROP_READ_TIMEOUT_MSEC (CAMERA_STALL_TIMEOUT 秒) まで戻らないことがあるので、それより長く待つ
+        for thread in (self._thread, self._reconnect_thread):
+            if thread is not None:
+                thread.join(timeout=config.CAMERA_STALL_TIMEOUT + 1.0)
+        if self._thread is not None and self._thread.is_alive():
+            # read() が戻らない。使用中のデバイスは解放せず、取得スレッドが終了時に解放する
+            print(f"⚠️ カメラ {self.index} の読み込みが終わらないため、解放を取得スレッドに任せます。")
+            return
+        self._thread = None
+        self._reconnect_thread = None
+        self._release_capture()
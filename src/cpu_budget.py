@@ -0,0 +1,189 @@
+import hashlib
+import os
+
+import onnxruntime as ort
+
+from config import config
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+GRAPH_OPT_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def parse_cores(text):
+    """
+    "0-3,6" 形式の文字列をコア番号のリストに変換する
+
+    :return: コア番号のリスト。空文字列の場合は空のリスト
+    """
+    cores = []
+    for item in text.replace(" ", "").split(","):
+        if not item:
+            continue
+        first, _, last = item.partition("-")
+        cores.extend(range(int(first), int(last or first) + 1))
+    return cores
+
+
+def available_cores():
+    """このプロセスが使えるコア番号のリストを返す"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    if psutil is not None:
+        return sorted(psutil.Process().cpu_affinity())
+    return list(range(os.cpu_count() or 1))
+
+
+def budget_cores(machine_ids, all_machine_ids=None):
+    """
+    使えるコアをカメラの台数で均等に分け、machine_ids のカメラに割り当てる分を返す
+
+    プロセスごとに担当カメラが異なっていても (identify00-03.py を並べて起動する場合など)、
+    全カメラの machine_id の順に重ならないコアを選ぶ。
+
+    :param machine_ids: このプロセスが処理するカメラの machine_id
+    :param all_machine_ids: 同じマシンで動く全カメラの machine_id (省略時は CAMERA_MAP のすべて)
+    :return: コア番号のリスト (最低1つ)
+    """
+    if all_machine_ids is None:
+        # CAMERA_MAP が auto の場合は、起こりうるすべての machine_id (0~3) で分ける
+        all_machine_ids = [
+            int(item.split(":")[1]) for item in config.CAMERA_MAP.replace(" ", ",").split(",") if ":" in item
+        ] or list(range(4))
+    all_machine_ids = sorted(set(all_machine_ids) | set(machine_ids))
+    cores = available_cores()
+    # キャプチャ・送信・メインループのためにコアを残しておく
+    usable = cores[:max(1, len(cores) - config.CPU_RESERVED_CORES)]
+    share = len(usable) / len(all_machine_ids)
+
+    selected = []
+    for machine_id in machine_ids:
+        position = all_machine_ids.index(machine_id)
+        selected.extend(usable[int(position * share):int((position + 1) * share)])
+    if not selected:
+        # カメラの台数よりコアが少ない場合は順に割り当てる
+        selected = [usable[all_machine_ids.index(machine_id) % len(usable)] for machine_id in machine_ids]
+    return sorted(set(selected))
+
+
+def pin_process(cores):
+    """このプロセスを指定したコアだけで動かす。対応していない環境では何もしない"""
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        elif psutil is not None:
+            psutil.Process().cpu_affinity(list(cores))
+        else:
+            print("⚠️ CPU affinity is not supported on this platform.")
+            return False
+    except OSError as e:
+        print(f"❌ Could not set CPU affinity {cores}: {e}")
+        return False
+    print(f"📌 Pinned to cores {cores}")
+    return True
+
+
+def apply_cpu_budget(machine_ids):
+    """
+    CPU_AFFINITY に従ってプロセスを固定し、検出モデルに使わせるスレッド数を返す
+
+    :param machine_ids: このプロセスが処理するカメラの machine_id
+    :return: ORT の intra-op スレッド数 (ORT_INTRA_THREADS が指定されていればその値)
+    """
+    cores = budget_cores(machine_ids)
+    if config.CPU_AFFINITY == "auto":
+        pin_process(cores)
+    elif config.CPU_AFFINITY:
+        cores = parse_cores(config.CPU_AFFINITY)
+        pin_process(cores)
+    return config.ORT_INTRA_THREADS or len(cores)
+
+
+def session_options(intra_threads=None, inter_threads=None, graph_opt_level=None):
+    """
+    config の ORT_* 設定から ONNX Runtime の SessionOptions を生成する
+
+    :param intra_threads: 1つの演算子に使うスレッド数 (省略時は ORT_INTRA_THREADS、0 の場合は ORT に任せる)
+    :param inter_threads: 演算子を並列に実行するスレッド数 (省略時は ORT_INTER_THREADS)
+    :param graph_opt_level: disable / basic / extended / all (省略時は ORT_GRAPH_OPT_LEVEL)
+    """
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = config.ORT_INTRA_THREADS if intra_threads is None else intra_threads
+    options.inter_op_num_threads = config.ORT_INTER_THREADS if inter_threads is None else inter_threads
+    options.graph_optimization_level = GRAPH_OPT_LEVELS[graph_opt_level or config.ORT_GRAPH_OPT_LEVEL]
+    options.execution_mode = (
+        ort.ExecutionMode.ORT_PARALLEL if options.inter_op_num_threads > 1 else ort.ExecutionMode.ORT_SEQUENTIAL
+    )
+    options.enable_cpu_mem_arena = config.ORT_CPU_MEM_ARENA
+    options.enable_mem_pattern = config.ORT_MEM_PATTERN
+    # 推論の合間にスレッドが空回りしてほかのカメラのコアを奪わないようにする
+    options.add_session_config_entry("session.intra_op.allow_spinning", "1" if config.ORT_ALLOW_SPINNING else "0")
+    return options
+
+
+def copy_session_options(options, **overrides):
+    """SessionOptions を複製する (呼び出し元の設定を書き換えないため)"""
+    copied = ort.SessionOptions()
+    for name in ("intra_op_num_threads", "inter_op_num_threads", "graph_optimization_level", "execution_mode",
+                 "enable_cpu_mem_arena", "enable_mem_pattern"):
+        setattr(copied, name, overrides.get(name, getattr(options, name)))
+    spinning = options.get_session_config_entry("session.intra_op.allow_spinning")
+    if spinning:
+        copied.add_session_config_entry("session.intra_op.allow_spinning", spinning)
+    return copied
+
+
+def _cache_path(model_path, options, providers):
+    """最適化済みモデルのキャッシュのパス。元のモデル・ORT のバージョン・最適化レベルが変わると別のファイルになる"""
+    stat = os.stat(model_path)
+    key = f"{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}:{ort.__version__}:" \
+          f"{int(options.graph_optimization_level)}:{','.join(providers)}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(os.path.expanduser(config.ORT_CACHE_DIR), f"{name}.{digest}.onnx")
+
+
+def create_session(model_path, options=None, providers=None):
+    """
+    InferenceSession を生成する
+
+    CPU で実行する場合 (使えない provider を除いた結果 CPU だけになる場合を含む) はグラフ最適化済みのモデルを
+    ORT_CACHE_DIR に保存し、次回からはそれを最適化なしで読み込む。
+    最適化済みのモデルはハードウェアに依存するので、同じマシンでだけ使う。
+    """
+    options = options or session_options()
+    # GPU のないマシンで CUDA を指定しても ORT は CPU で実行するので、実際に使えるものだけに絞ってから判断する
+    available = ort.get_available_providers()
+    providers = [provider for provider in providers or [] if provider in available] or ["CPUExecutionProvider"]
+    if not config.ORT_CACHE_DIR or providers != ["CPUExecutionProvider"]:
+        return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+
+    cache_path = _cache_path(model_path, options, providers)
+    if os.path.exists(cache_path):
+        try:
+            cached = copy_session_options(
+                options, graph_optimization_level=ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            )
+            return ort.InferenceSession(cache_path, sess_options=cached, providers=providers)
+        except Exception as e:
+            print(f"⚠️ Ignoring broken ORT cache {cache_path}: {e}")
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    writing = copy_session_options(options)
+    # 書き込み途中で落ちても壊れたキャッシュが残らないように、一時ファイルに書いてから置き換える
+    writing.optimized_model_filepath = f"{cache_path}.{os.getpid()}.tmp"
+    session = ort.InferenceSession(model_path, sess_options=writing, providers=providers)
+    try:
+        os.replace(writing.optimized_model_filepath, cache_path)
+        print(f"💾 Cached optimized model to {cache_path}")
+    except OSError as e:
+        print(f"⚠️ Could not cache optimized model: {e}")
+    return session
@@ -1,33 +1,408 @@
-from insightface.app import FaceAnalysis
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
 
 from config import config
+from cpu_budget import session_options as default_session_options
+from detector_backends import YuNetDetector
+from metrics import metrics
+from scrfd import SCRFDDetector, decode_outputs, letterbox
+
+
+def parse_roi(text):
+    """
+    "x,y,w,h" 形式の文字列を ROI のタプルに変換する
+
+    :return: (x, y, w, h)。空文字列の場合は None (フレーム全体)
+    """
+    if not text:
+        return None
+    x, y, w, h = (int(v) for v in text.split(","))
+    return x, y, w, h
+
+
+# ArcFace の 112×112 の基準ランドマーク (ウォームアップ用のダミーの顔に使う)
+_DUMMY_KPS = np.array(
+    [[38.3, 51.7], [73.5, 51.5], [56.0, 71.7], [41.5, 92.4], [70.7, 92.2]], dtype=np.float32
+)
+
+
+def _round_up(value, multiple):
+    return (value + multiple - 1) // multiple * multiple
+
 
 class FaceDetector:
-    def __init__(self):
+    def __init__(self, detection_only=None, det_size=None, session_options=None, backend=None):
+        """
+        :param detection_only: True の場合は検出モデルのみを読み込む (省略時は config.DETECTION_ONLY)
+        :param backend: 検出モデルの種類 insightface / int8 / yunet (省略時は config.DET_BACKEND)
+        :param det_size: 検出モデルの入力サイズ (width, height) (省略時は config.DET_SIZE)
+        :param session_options: ONNX Runtime の SessionOptions (省略時は config の ORT_* 設定から生成)
+        """
         self.device = config.DEVICE
-        self.app = FaceAnalysis(
-            name="buffalo_l",
-            providers=["CUDAExecutionProvider"]
+        self.detection_only = config.DETECTION_ONLY if detection_only is None else detection_only
+        self.det_size = det_size or config.DET_SIZE
+        self.backend = backend or config.DET_BACKEND
+        self.providers = (
+            ["CUDAExecutionProvider"]
             if self.device == "cuda"
-            else ["CPUExecutionProvider"],
+            else ["CPUExecutionProvider"]
         )
-        self.app.prepare(ctx_id=0 if self.device == "cuda" else -1)
-    
-    def detect_face(self, frame):
-        faces = self.app.get(frame)
+        self.ctx_id = 0 if self.device == "cuda" else -1
+        self.session_options = session_options or default_session_options()
+        self.model_dir = self._find_model_dir()
+        self.recognizer = None
+
+        if self.detection_only:
+            # 検出モデルだけを読み込み、ランドマーク・性別年齢・認識モデルは読み込まない
+            self.app = None
+            self.det_model = self._load_detector()
+        else:
+            # insightface の読み込みは重いので、必要な場合だけ import する
+            from insightface.app import FaceAnalysis
+
+            self.app = FaceAnalysis(
+                name=config.MODEL_NAME,
+                root=config.MODEL_ROOT,
+                providers=self.providers,
+                sess_options=self.session_options,
+            )
+            self.app.prepare(ctx_id=self.ctx_id, det_thresh=config.DET_THRESH, det_size=self.det_size)
+            self.det_model = self.app.det_model if self.backend == "insightface" else self._load_detector()
+            self.recognizer = self.app.models.get("recognition")
+
+    @staticmethod
+    def _find_model_dir():
+        """モデルのディレクトリを返す。まだない場合のみ insightface でダウンロードする"""
+        model_dir = os.path.join(os.path.expanduser(config.MODEL_ROOT), "models", config.MODEL_NAME)
+        if os.path.isdir(model_dir):
+            return model_dir
+        from insightface.utils.storage import ensure_available
+
+        return ensure_available("models", config.MODEL_NAME, root=config.MODEL_ROOT)
+
+    def _load_detector(self):
+        """DET_BACKEND に応じた検出モデルを読み込む"""
+        if self.backend == "yunet":
+            return YuNetDetector()
+
+        if self.backend == "int8":
+            filename = config.DET_INT8_MODEL_FILE
+            if not os.path.exists(os.path.join(self.model_dir, filename)):
+                raise RuntimeError(
+                    f"❌ INT8 の検出モデル {filename} がありません。"
+                    "python src/detector_backends.py --calibration <映像> で作成してください。"
+                )
+        elif self.backend == "insightface":
+            filename = config.DET_MODEL_FILE
+        else:
+            raise ValueError(f"DET_BACKEND '{self.backend}' は insightface / int8 / yunet のいずれかにしてください。")
+
+        model = SCRFDDetector(os.path.join(self.model_dir, filename), self.session_options, self.providers)
+        model.prepare(self.ctx_id, input_size=self.det_size, det_thresh=config.DET_THRESH)
+        return model
+
+    def _load_model(self, filename):
+        """モデルディレクトリから insightface の ONNX モデルを1つ読み込む"""
+        from insightface.model_zoo import model_zoo
 
-        if not faces:
+        return model_zoo.get_model(
+            os.path.join(self.model_dir, filename), providers=self.providers, sess_options=self.session_options
+        )
+
+    def _prepare_input(self, frame, roi=None, min_face=None):
+        """
+        ROI で切り出し、最小の顔が DET_MIN_FACE_PX 程度になるまで縮小する
+
+        :return: (image, (offset_x, offset_y), scale)
+        """
+        offset = (0, 0)
+        image = frame
+        if roi is not None:
+            x, y, w, h = roi
+            image = frame[y:y + h, x:x + w]
+            offset = (x, y)
+
+        scale = 1.0
+        if min_face:
+            scale = min(1.0, config.DET_MIN_FACE_PX / min_face)
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return image, offset, scale
+
+    def _input_size(self, image):
+        """入力画像に合わせた検出モデルの入力サイズを返す (動的入力のモデルのみ)"""
+        if not config.DET_ADAPTIVE_SIZE or not isinstance(self.det_model.input_shape[2], str):
+            return None
+
+        h, w = image.shape[:2]
+        det_w, det_h = self.det_size
+        if w > det_w or h > det_h:
             return None
-        
-        largest_face = max(
-            faces,
-            key=lambda face: (face.bbox[2] - face.bbox[0])
-            * (face.bbox[3] - face.bbox[1]),
+        # 検出モデルのストライド (最大32) の倍数に揃え、余分なパディングを推論しない
+        return _round_up(w, 32), _round_up(h, 32)
+
+    def detect(self, frame, roi=None, min_face=None):
+        """
+        検出モデルのみを実行する
+
+        :param roi: 検出対象の領域 (x, y, w, h)。None の場合はフレーム全体
+        :param min_face: 検出したい最小の顔の大きさ (px)。指定すると入力を縮小する
+        :return: (bboxes, kpss)。フレーム座標の bboxes (N, 5) [x1, y1, x2, y2, score] と kpss (N, 5, 2)
+        """
+        start = time.perf_counter()
+        image, offset, scale = self._prepare_input(frame, roi, min_face)
+        bboxes, kpss = self.det_model.detect(
+            image, input_size=self._input_size(image), max_num=0, metric="default"
+        )
+        metrics.observe("detect", time.perf_counter() - start)
+        return self._to_frame_coords(bboxes, kpss, offset, scale)
+
+    def _to_frame_coords(self, bboxes, kpss, offset, scale):
+        """切り出し・縮小した画像の座標を元のフレームの座標に戻す"""
+        offset_x, offset_y = offset
+        if scale != 1.0 or offset_x or offset_y:
+            bboxes[:, :4] /= scale
+            bboxes[:, [0, 2]] += offset_x
+            bboxes[:, [1, 3]] += offset_y
+            if kpss is not None:
+                kpss /= scale
+                kpss[:, :, 0] += offset_x
+                kpss[:, :, 1] += offset_y
+        return bboxes, kpss
+
+    def supports_batch(self):
+        """検出モデルが複数枚の入力を1回で推論できるか (入力のバッチ次元が可変か) を返す"""
+        return hasattr(self.det_model, "session") and self.det_model.input_shape[0] != 1
+
+    def detect_batch(self, frames, rois=None, min_faces=None):
+        """
+        複数のフレーム (複数カメラ) をまとめて1回の推論で検出する
+
+        :param frames: フレームのリスト
+        :param rois: フレームごとの ROI のリスト (省略時はすべてフレーム全体)
+        :param min_faces: フレームごとの最小の顔の大きさのリスト
+        :return: フレームと同じ順の (bboxes, kpss) のリスト
+        """
+        count = len(frames)
+        rois = rois or [None] * count
+        min_faces = min_faces or [None] * count
+        if count == 1 or not self.supports_batch():
+            return [self.detect(f, r, m) for f, r, m in zip(frames, rois, min_faces)]
+
+        start = time.perf_counter()
+        model = self.det_model
+        prepared = [self._prepare_input(f, r, m) for f, r, m in zip(frames, rois, min_faces)]
+
+        # バッチ内の入力サイズは揃える必要があるので、最も大きい画像に合わせる
+        sizes = [self._input_size(image) for image, _, _ in prepared]
+        if any(size is None for size in sizes):
+            input_size = model.input_size or self.det_size
+        else:
+            input_size = (max(w for w, _ in sizes), max(h for _, h in sizes))
+
+        letterboxed = [letterbox(image, input_size) for image, _, _ in prepared]
+        blob = cv2.dnn.blobFromImages(
+            [image for image, _ in letterboxed], 1.0 / model.input_std, input_size,
+            (model.input_mean, model.input_mean, model.input_mean), swapRB=True,
         )
-        x1, y1, x2, y2 = map(int, largest_face.bbox)
+        net_outs = model.session.run(model.output_names, {model.input_name: blob})
+
+        results = []
+        for index, ((_, offset, scale), (_, det_scale)) in enumerate(zip(prepared, letterboxed)):
+            bboxes, kpss = decode_outputs(model, net_outs, index, count, input_size, det_scale)
+            results.append(self._to_frame_coords(bboxes, kpss, offset, scale))
+        metrics.observe("detect_batch", time.perf_counter() - start, camera="all")
+        return results
+
+    def detect_faces(self, frame, roi=None, min_face=None):
+        """
+        端で切れていないすべての顔を返す
 
+        :return: (boxes, scores, kpss)。フレーム座標の boxes (N, 4)、scores (N,)、kpss (N, 5, 2) または None
+        """
+        bboxes, kpss = self.detect(frame, roi, min_face)
+        return self.filter_faces(frame, bboxes, kpss, roi)
+
+    @staticmethod
+    def filter_faces(frame, bboxes, kpss, roi=None):
+        """検出結果から、フレーム (ROI 指定時は ROI) の端で切れている顔をまとめて取り除く"""
+        h, w = frame.shape[:2]
+        left, top, right, bottom = 0, 0, w, h
+        if roi is not None:
+            left, top = roi[0], roi[1]
+            right, bottom = min(w, roi[0] + roi[2]), min(h, roi[1] + roi[3])
+        boxes = bboxes[:, :4]
+        inside = (
+            (boxes[:, 0] >= left) & (boxes[:, 1] >= top) & (boxes[:, 2] <= right) & (boxes[:, 3] <= bottom)
+        )
+        if inside.any():
+            metrics.inc("faces_seen", int(inside.sum()))
+        return boxes[inside], bboxes[inside, 4], kpss[inside] if kpss is not None else None
+
+    def detect_largest(self, frame, roi=None, min_face=None):
+        """
+        最も大きい顔の枠とランドマークを返す
+
+        :return: ([x1, y1, x2, y2], kps)。顔がない、または端で切れている場合は None
+        """
+        bboxes, kpss = self.detect(frame, roi, min_face)
+        return self.pick_largest(frame, bboxes, kpss, roi)
+
+    @staticmethod
+    def pick_largest(frame, bboxes, kpss, roi=None):
+        """検出結果から最も大きい顔を選ぶ。端で切れている場合は None"""
+        if bboxes.shape[0] == 0:
+            return None
+
+        areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+        largest = np.argmax(areas)
+        x1, y1, x2, y2 = map(int, bboxes[largest, :4])
+
+        # フレーム (ROI 指定時は ROI) の端で切れている顔は除外する
         h, w, _ = frame.shape
-        if x1 < 0 or y1 < 0 or x2 > w or y2 > h:
+        left, top, right, bottom = 0, 0, w, h
+        if roi is not None:
+            left, top = roi[0], roi[1]
+            right, bottom = min(w, roi[0] + roi[2]), min(h, roi[1] + roi[3])
+        if x1 < left or y1 < top or x2 > right or y2 > bottom:
             return None
-        
-        return [x1, y1, x2, y2]
\ No newline at end of file
+
+        kps = kpss[largest] if kpss is not None else None
+        metrics.inc("faces_seen")
+        return [x1, y1, x2, y2], kps
+
+    def detect_face(self, frame, roi=None, min_face=None):
+        result = self.detect_largest(frame, roi, min_face)
+        return result[0] if result is not None else None
+
+    def _get_recognizer(self):
+        """ArcFace 認識モデルを初めて必要になった時に読み込む"""
+        if self.recognizer is None:
+            print("🧠 Loading recognition model...")
+            self.recognizer = self._load_model(config.REC_MODEL_FILE)
+            self.recognizer.prepare(self.ctx_id)
+        return self.recognizer
+
+    def get_embedding(self, frame, kps):
+        """
+        顔のランドマークから切り出した画像の埋め込みベクトルを計算する
+
+        :param frame: 元のフレーム
+        :param kps: 検出モデルが返す5点ランドマーク (5, 2)
+        :return: L2正規化済みの埋め込みベクトル
+        """
+        from insightface.utils import face_align
+
+        recognizer = self._get_recognizer()
+        aligned = face_align.norm_crop(frame, landmark=kps, image_size=recognizer.input_size[0])
+        embedding = recognizer.get_feat(aligned).flatten()
+        return embedding / np.linalg.norm(embedding)
+
+    def warmup(self, roi=None, min_face=None, recognition=False):
+        """
+        ダミーのフレームで推論し、最初の実フレームで初回推論の遅延が出ないようにする
+
+        カメラごとに ROI と縮小率が違うと入力サイズも変わるので、カメラごとに呼ぶ。
+        """
+        frame = np.zeros((config.FRAME_HEIGHT, config.FRAME_WIDTH, 3), dtype=np.uint8)
+        self.detect(frame, roi, min_face)
+        if recognition:
+            self.get_embedding(frame, _DUMMY_KPS)
+
+
+class BatchDetector:
+    """
+    複数カメラのスレッドから検出要求を集め、FaceDetector.detect_batch でまとめて推論するクラス
+
+    FaceDetector と同じ detect / detect_faces / detect_largest / detect_face / get_embedding を持ち、FaceIdentification に
+    そのまま渡せる。要求は DET_BATCH_SIZE 件たまるか、最初の要求から DET_BATCH_MAX_WAIT 秒経つと実行する。
+    """
+
+    def __init__(self, detector=None, batch_size=None, max_wait=None):
+        """
+        :param detector: 推論に使う FaceDetector (省略時は新規に生成)
+        :param batch_size: 1回の推論にまとめる最大フレーム数 (省略時は config.DET_BATCH_SIZE)
+        :param max_wait: バッチがそろうのを待つ最大秒数 (省略時は config.DET_BATCH_MAX_WAIT)
+        """
+        self.detector = detector if detector is not None else FaceDetector()
+        self.batch_size = config.DET_BATCH_SIZE if batch_size is None else batch_size
+        self.max_wait = config.DET_BATCH_MAX_WAIT if max_wait is None else max_wait
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.batched_frames = 0
+        self._worker = threading.Thread(target=self._worker_loop, name="BatchDetector", daemon=True)
+        self._worker.start()
+
+    def submit(self, frame, roi=None, min_face=None):
+        """検出を要求する。(bboxes, kpss) を返す Future を返す"""
+        future = Future()
+        self.queue.put((frame, roi, min_face, future))
+        return future
+
+    def detect(self, frame, roi=None, min_face=None):
+        return self.submit(frame, roi, min_face).result()
+
+    def detect_faces(self, frame, roi=None, min_face=None):
+        bboxes, kpss = self.detect(frame, roi, min_face)
+        return self.detector.filter_faces(frame, bboxes, kpss, roi)
+
+    def detect_largest(self, frame, roi=None, min_face=None):
+        bboxes, kpss = self.detect(frame, roi, min_face)
+        return self.detector.pick_largest(frame, bboxes, kpss, roi)
+
+    def detect_face(self, frame, roi=None, min_face=None):
+        result = self.detect_largest(frame, roi, min_face)
+        return result[0] if result is not None else None
+
+    def get_embedding(self, frame, kps):
+        return self.detector.get_embedding(frame, kps)
+
+    def warmup(self, roi=None, min_face=None, recognition=False):
+        """FaceDetector.warmup に加えて、バッチの大きさでも1回推論しておく"""
+        self.detector.warmup(roi, min_face, recognition)
+        if self.detector.supports_batch():
+            frame = np.zeros((config.FRAME_HEIGHT, config.FRAME_WIDTH, 3), dtype=np.uint8)
+            self.detector.detect_batch([frame] * self.batch_size, [roi] * self.batch_size, [min_face] * self.batch_size)
+
+    def _collect(self):
+        """最初の要求を待ち、batch_size 件または max_wait 秒まで続きの要求を集める"""
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker_loop(self):
+        while True:
+            batch = self._collect()
+            frames, rois, min_faces, futures = zip(*batch)
+            try:
+                results = self.detector.detect_batch(list(frames), list(rois), list(min_faces))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched_frames += len(batch)
+            metrics.inc("detect_batches", camera="all")
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def stats(self):
+        """バッチの回数と平均サイズを返す"""
+        return {
+            "batches": self.batches,
+            "mean_batch_size": self.batched_frames / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,133 @@
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+from config import config
+from scrfd import letterbox
+
+
+class YuNetDetector:
+    """
+    OpenCV の FaceDetectorYN (YuNet) を insightface の検出モデルと同じ detect() で呼べるようにするクラス
+
+    YuNet は任意の入力サイズで推論できるので、入力画像をそのままの大きさで渡す。
+    """
+
+    def __init__(self, model_path=None, det_thresh=None, nms_thresh=None):
+        """
+        :param model_path: YuNet の ONNX モデル (省略時は config.YUNET_MODEL_PATH)
+        :param det_thresh: 顔とみなすスコアの閾値 (省略時は config.DET_THRESH)
+        :param nms_thresh: NMS の IoU 閾値 (省略時は config.YUNET_NMS_THRESH)
+        """
+        model_path = os.path.expanduser(model_path or config.YUNET_MODEL_PATH)
+        if not os.path.exists(model_path):
+            raise RuntimeError(
+                f"❌ YuNet のモデル {model_path} がありません。"
+                "opencv_zoo の face_detection_yunet を配置し、YUNET_MODEL_PATH を設定してください。"
+            )
+        self.det_thresh = config.DET_THRESH if det_thresh is None else det_thresh
+        self.model = cv2.FaceDetectorYN.create(
+            model_path, "", (320, 320),
+            self.det_thresh,
+            config.YUNET_NMS_THRESH if nms_thresh is None else nms_thresh,
+            5000,
+        )
+        self.input_shape = [1, 3, "h", "w"]
+        self.input_size = None
+        self.taskname = "detection"
+
+    def prepare(self, ctx_id, **kwargs):
+        pass
+
+    def detect(self, img, input_size=None, max_num=0, metric="default"):
+        """
+        :return: (bboxes, kpss)。bboxes (N, 5) [x1, y1, x2, y2, score] と kpss (N, 5, 2)
+        """
+        h, w = img.shape[:2]
+        self.model.setInputSize((w, h))
+        _, faces = self.model.detect(img)
+        if faces is None:
+            return np.zeros((0, 5), dtype=np.float32), np.zeros((0, 5, 2), dtype=np.float32)
+
+        # YuNet の出力は [x, y, w, h, 右目x, 右目y, 左目x, 左目y, 鼻x, 鼻y, 口右x, 口右y, 口左x, 口左y, score]
+        bboxes = np.empty((faces.shape[0], 5), dtype=np.float32)
+        bboxes[:, 0:2] = faces[:, 0:2]
+        bboxes[:, 2:4] = faces[:, 0:2] + faces[:, 2:4]
+        bboxes[:, 4] = faces[:, 14]
+        kpss = faces[:, 4:14].reshape(-1, 5, 2).astype(np.float32)
+
+        if max_num > 0 and bboxes.shape[0] > max_num:
+            areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+            keep = np.argsort(areas)[::-1][:max_num]
+            bboxes, kpss = bboxes[keep], kpss[keep]
+        return bboxes, kpss
+
+
+class _FrameCalibrationReader:
+    """静的量子化の較正用に、フレームを検出モデルと同じ前処理で1枚ずつ渡す"""
+
+    def __init__(self, input_name, frames, input_size):
+        self.input_name = input_name
+        self.input_size = input_size
+        self.frames = iter(frames)
+
+    def get_next(self):
+        frame = next(self.frames, None)
+        if frame is None:
+            return None
+        det_img, _ = letterbox(frame, self.input_size)
+        blob = cv2.dnn.blobFromImage(det_img, 1.0 / 128.0, self.input_size, (127.5, 127.5, 127.5), swapRB=True)
+        return {self.input_name: blob}
+
+
+def quantize_detector(model_path, output_path, calibration_frames, input_size=None):
+    """
+    検出モデルを静的量子化 (QDQ、チャネルごと) で INT8 にして保存する
+
+    重みだけの動的量子化は畳み込みが ConvInteger になり、CPU ではほとんどの場合 FP32 より遅いので使わない。
+    作成したモデルは benchmark.py --stage backends で FP32 より速く、検出結果が変わらないことを確かめてから使う。
+    :param calibration_frames: 較正に使うフレームのリスト (空にはできない)
+    :param input_size: 較正時の入力サイズ (width, height) (省略時は config.DET_SIZE)
+    """
+    import onnx
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    if not calibration_frames:
+        raise ValueError("❌ 較正に使うフレームがありません。--calibration に映像を指定してください。")
+    input_name = onnx.load(model_path, load_external_data=False).graph.input[0].name
+    reader = _FrameCalibrationReader(input_name, calibration_frames, tuple(input_size or config.DET_SIZE))
+    quantize_static(
+        model_path, output_path, reader,
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    print(f"💾 Saved INT8 detection model to {output_path}")
+
+
+if __name__ == "__main__":
+    from insightface.utils.storage import ensure_available
+
+    from sources import open_source
+
+    parser = argparse.ArgumentParser(description="検出モデルを INT8 に量子化する")
+    parser.add_argument("--calibration", required=True, help="較正に使う動画ファイルまたは画像ディレクトリ")
+    parser.add_argument("--frames", type=int, default=200, help="較正に使う最大フレーム数")
+    args = parser.parse_args()
+
+    model_dir = ensure_available("models", config.MODEL_NAME, root=config.MODEL_ROOT)
+    frames = []
+    source = open_source(args.calibration)
+    while not getattr(source, "exhausted", False) and len(frames) < args.frames:
+        frame = source.get_frame()
+        if frame is not None:
+            frames.append(frame)
+    source.release()
+    quantize_detector(
+        os.path.join(model_dir, config.DET_MODEL_FILE),
+        os.path.join(model_dir, config.DET_INT8_MODEL_FILE),
+        frames,
+    )
@@ -0,0 +1,231 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from config import config
+
+SYSFS_VIDEO = "/sys/class/video4linux"
+MACHINE_IDS = range(4)  # SenderTCP が受け付ける machine_id
+
+
+def parse_camera_map(text):
+    """
+    "4:0,2:1" 形式の文字列を {camera_index: machine_id} に変換する
+
+    :param text: カンマ区切りの camera_index:machine_id
+    :return: camera_index をキー、machine_id を値とする辞書
+    """
+    camera_map = {}
+    for item in text.replace(" ", ",").split(","):
+        if not item:
+            continue
+        camera_index, machine_id = item.split(":")
+        camera_map[int(camera_index)] = int(machine_id)
+    return camera_map
+
+
+def _read_sysfs(path):
+    try:
+        with open(path, encoding="utf-8") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def _usb_stable_id(video_dir):
+    """
+    sysfs からデバイスの USB のシリアル番号、なければ接続ポートのパスを求める
+
+    再起動で /dev/videoN の番号が変わっても、同じカメラ (同じポート) なら同じ値になる。
+    """
+    device = os.path.realpath(os.path.join(video_dir, "device"))
+    # device は USB インターフェース (例: .../usb1/1-2/1-2:1.0)。親が USB デバイス本体
+    usb_device = os.path.dirname(device)
+    serial = _read_sysfs(os.path.join(usb_device, "serial"))
+    vendor = _read_sysfs(os.path.join(usb_device, "idVendor"))
+    product = _read_sysfs(os.path.join(usb_device, "idProduct"))
+    if serial and vendor and product:
+        return f"usb-{vendor}:{product}-{serial}"
+    port = os.path.basename(usb_device)
+    if re.fullmatch(r"\d+-[\d.]+", port):
+        return f"usb-path-{port}"
+    return f"path-{device}"
+
+
+def list_linux_devices():
+    """sysfs から /dev/video* を列挙する。メタデータ用のノードは除く"""
+    devices = []
+    for video_dir in sorted(glob.glob(os.path.join(SYSFS_VIDEO, "video*"))):
+        name = os.path.basename(video_dir)
+        # UVC カメラは1台で複数のノードを作る。index が 0 のものが映像を取得するノード
+        if _read_sysfs(os.path.join(video_dir, "index")) not in (None, "0"):
+            continue
+        devices.append({
+            "index": int(name[len("video"):]),
+            "path": f"/dev/{name}",
+            "name": _read_sysfs(os.path.join(video_dir, "name")) or name,
+            "stable_id": _usb_stable_id(video_dir),
+        })
+    return devices
+
+
+def supports_stable_ids():
+    """
+    デバイスの番号と stable_id を確実に対応付けられるかを返す (Linux の sysfs のみ)
+
+    Windows の WMI の列挙順は DirectShow のインデックスと一致する保証がないので、対応付けに使わない。
+    """
+    return platform.system() == "Linux" and os.path.isdir(SYSFS_VIDEO)
+
+
+def list_devices():
+    """OS に応じてカメラを列挙する。sysfs がない場合は番号だけのデバイスを返す"""
+    if supports_stable_ids():
+        return list_linux_devices()
+    return [
+        {"index": i, "path": None, "name": f"Camera {i}", "stable_id": f"index-{i}"}
+        for i in range(config.CAMERA_PROBE_MAX)
+    ]
+
+
+def probe_device(device):
+    """カメラを開いて1フレーム読み、使えるかどうかと解像度を device に書き込む"""
+    api = cv2.CAP_V4L2 if device["path"] else cv2.CAP_ANY
+    cap = cv2.VideoCapture(device["index"], api)
+    try:
+        ok, frame = cap.read() if cap.isOpened() else (False, None)
+        device["available"] = bool(ok)
+        device["resolution"] = (frame.shape[1], frame.shape[0]) if ok else None
+        device["fourcc"] = (
+            int(cap.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, "little").decode(errors="replace") if ok else None
+        )
+    finally:
+        cap.release()
+    return device
+
+
+def discover_cameras(probe=True):
+    """
+    カメラを列挙し、すべてのデバイスを並行して開いて確認する
+
+    :param probe: False の場合は開かずに列挙だけ行う
+    :return: 使えるデバイスの辞書のリスト (index / path / name / stable_id / available / resolution)
+    """
+    devices = list_devices()
+    if not probe or not devices:
+        return devices
+    with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+        devices = list(executor.map(probe_device, devices))
+    return [device for device in devices if device["available"]]
+
+
+def load_device_map(path=None):
+    """保存済みの {stable_id: machine_id} を読み込む"""
+    path = path or config.CAMERA_DEVICE_MAP_PATH
+    try:
+        with open(path, encoding="utf-8") as file:
+            return {key: int(value) for key, value in json.load(file).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def save_device_map(device_map, path=None):
+    path = path or config.CAMERA_DEVICE_MAP_PATH
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(device_map, file, indent=2, ensure_ascii=False)
+
+
+def assign_machine_ids(devices, device_map):
+    """
+    見つかったデバイスを machine_id に対応付ける
+
+    保存済みのデバイスは同じ machine_id を使い、新しいデバイスには空いている machine_id を
+    stable_id の順に割り当てる (device_map を更新する)。
+    :return: {camera_index: machine_id}
+    """
+    camera_map = {}
+    used = set(device_map.values())
+    for device in sorted(devices, key=lambda d: d["stable_id"]):
+        machine_id = device_map.get(device["stable_id"])
+        if machine_id is None:
+            free = [i for i in MACHINE_IDS if i not in used]
+            if not free:
+                print(f"⚠️ No machine_id left for {device['name']} ({device['stable_id']}), ignoring it.")
+                continue
+            machine_id = device_map[device["stable_id"]] = free[0]
+            used.add(machine_id)
+            print(f"🆕 {device['name']} ({device['stable_id']}) → machine_id {machine_id}")
+        camera_map[device["index"]] = machine_id
+    return camera_map
+
+
+def resolve_camera_map(text=None):
+    """
+    CAMERA_MAP を {camera_index: machine_id} に変換する
+
+    "auto" の場合はカメラを探し、保存済みの stable_id → machine_id の対応から現在のインデックスを求める。
+    """
+    text = config.CAMERA_MAP if text is None else text
+    if text == "auto" and not supports_stable_ids():
+        print(f"⚠️ CAMERA_MAP=auto is only supported on Linux, using CAMERA_MAP_FALLBACK ({config.CAMERA_MAP_FALLBACK}).")
+        text = config.CAMERA_MAP_FALLBACK
+    if text != "auto":
+        return parse_camera_map(text)
+
+    devices = discover_cameras()
+    device_map = load_device_map()
+    camera_map = assign_machine_ids(devices, device_map)
+    save_device_map(device_map)
+    if not camera_map:
+        raise RuntimeError("❌ 使えるカメラが見つかりませんでした。")
+    summary = ", ".join(f"{index}:{machine_id}" for index, machine_id in sorted(camera_map.items()))
+    print(f"🔎 Discovered cameras: {summary}")
+    return camera_map
+
+
+def camera_index_for(machine_id, default):
+    """
+    identify00-03.py 用に、machine_id のカメラの現在のインデックスを返す
+
+    CAMERA_MAP が "auto" 以外の場合は default を返す。"auto" の場合はほかのプロセスがカメラを使っている
+    可能性があるので開いて確認はせず、保存済みの対応 (discovery.py で作成) だけから求める。
+    """
+    if config.CAMERA_MAP != "auto":
+        return default
+    if not supports_stable_ids():
+        print(f"⚠️ CAMERA_MAP=auto is only supported on Linux, using camera {default}.")
+        return default
+    stable_ids = [key for key, value in load_device_map().items() if value == machine_id]
+    for device in discover_cameras(probe=False):
+        if device["stable_id"] in stable_ids:
+            return device["index"]
+    raise RuntimeError(
+        f"❌ machine_id {machine_id} のカメラが見つかりません。python src/discovery.py で対応を作成してください。"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="カメラを探し、stable_id と machine_id の対応を保存する")
+    parser.add_argument("--reset", action="store_true", help="保存済みの対応を破棄して割り当て直す")
+    args = parser.parse_args()
+
+    if not supports_stable_ids():
+        raise SystemExit("❌ カメラの対応の保存は Linux (sysfs) でのみ対応しています。CAMERA_MAP を指定してください。")
+    devices = discover_cameras()
+    device_map = {} if args.reset else load_device_map()
+    camera_map = assign_machine_ids(devices, device_map)
+    save_device_map(device_map)
+    for device in devices:
+        machine_id = camera_map.get(device["index"])
+        resolution = "x".join(map(str, device["resolution"])) if device["resolution"] else "-"
+        print(
+            f"{device['index']}: {device['name']} | {device['stable_id']} | {resolution} {device['fourcc']} "
+            f"| machine_id {machine_id if machine_id is not None else '-'}"
+        )
+    print(f"💾 Saved camera map to {config.CAMERA_DEVICE_MAP_PATH}")
@@ -0,0 +1,303 @@
+import argparse
+import multiprocessing
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from camera import Camera
+from config import config
+from preview import install_signal_handlers
+
+
+META_SIZE = 4  # ヘッダーの先頭に書くスロット数とフレームの形状 (高さ・幅・チャンネル数)
+
+
+def ring_name(camera_index):
+    """カメラ番号に対応する共有メモリの名前"""
+    return f"{config.FRAME_BUS_PREFIX}{camera_index}"
+
+
+class FrameRing:
+    """
+    共有メモリ上の固定サイズのフレームのリングバッファ (1カメラ分)
+
+    書き込み側は1プロセスのみ。各スロットにはシーケンス番号を持たせ、書き込み中は -1 にする。
+    ヘッダーにはスロット数とフレームの形状を書き、設定の違う読み込み側は接続時にエラーにする。
+    read_latest() はスロットのビューを返すので、読み込み側は使い終わった後 (コピーした後) に
+    is_current(seq) で上書きされていないかを確認する。
+    """
+
+    def __init__(self, name, shape=None, slots=None, create=False):
+        """
+        :param name: 共有メモリの名前
+        :param shape: フレームの形状 (省略時は FRAME_HEIGHT×FRAME_WIDTH×3)
+        :param slots: スロット数 (省略時は config.FRAME_BUS_SLOTS)
+        :param create: True の場合は新規に作成する (書き込み側)。False の場合は既存のものに接続する
+        """
+        self.name = name
+        self.shape = tuple(shape) if shape is not None else (config.FRAME_HEIGHT, config.FRAME_WIDTH, 3)
+        self.slots = config.FRAME_BUS_SLOTS if slots is None else slots
+        self.owner = create
+
+        header_size = 8 * (META_SIZE + 1 + 2 * self.slots)
+        frame_size = int(np.prod(self.shape))
+        self.shm = self._open(name, header_size + frame_size * self.slots, create)
+
+        buf = self.shm.buf
+        meta = np.ndarray((META_SIZE,), dtype=np.int64, buffer=buf, offset=0)
+        expected = (self.slots,) + self.shape
+        if create:
+            meta[1:] = self.shape
+            # スロット数を最後に書き、接続側が書き込み途中のヘッダーを読まないようにする
+            meta[0] = self.slots
+        elif tuple(meta) != expected:
+            written = tuple(int(v) for v in meta)
+            del meta
+            self.shm.close()
+            if written[0] == 0:
+                # 書き込み側がまだヘッダーを書いていない (作成されていない場合と同じく接続し直させる)
+                raise FileNotFoundError(name)
+            raise RuntimeError(
+                f"❌ フレームバス {name} の形式が設定と違います "
+                f"(書き込み側: {written[0]} slots {written[1:]}, 設定: {self.slots} slots {self.shape})。"
+                "FRAME_WIDTH / FRAME_HEIGHT / FRAME_BUS_SLOTS を揃えてください。"
+            )
+        del meta
+
+        offset = 8 * META_SIZE
+        self.latest = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=offset)
+        self.slot_seq = np.ndarray((self.slots,), dtype=np.int64, buffer=buf, offset=offset + 8)
+        self.timestamps = np.ndarray(
+            (self.slots,), dtype=np.float64, buffer=buf, offset=offset + 8 * (1 + self.slots)
+        )
+        self.frames = np.ndarray((self.slots,) + self.shape, dtype=np.uint8, buffer=buf, offset=header_size)
+        if create:
+            self.latest[0] = 0
+            self.slot_seq[:] = 0
+
+    @staticmethod
+    def _open(name, size, create):
+        if create:
+            try:
+                # 前回異常終了した場合の残骸を削除してから作り直す
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+            return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:  # Python 3.12 以前
+            shm = shared_memory.SharedMemory(name=name)
+            # 接続しただけのプロセスの終了時に resource_tracker が共有メモリを削除しないようにする
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+            return shm
+
+    def begin_write(self):
+        """
+        次に書き込むスロットを確保する
+
+        :return: (seq, スロットのビュー)。書き込み後に commit(seq) を呼ぶ
+        """
+        seq = int(self.latest[0]) + 1
+        slot = seq % self.slots
+        self.slot_seq[slot] = -1
+        return seq, self.frames[slot]
+
+    def commit(self, seq, timestamp=None):
+        """書き込んだスロットを最新フレームとして公開する"""
+        slot = seq % self.slots
+        self.timestamps[slot] = time.time() if timestamp is None else timestamp
+        self.slot_seq[slot] = seq
+        self.latest[0] = seq
+
+    def write(self, frame):
+        """フレームをコピーして書き込む"""
+        seq, slot = self.begin_write()
+        slot[...] = frame
+        self.commit(seq)
+        return seq
+
+    def read_latest(self):
+        """
+        最新フレームのスロットのビューを返す (コピーしない)
+
+        ビューは書き込み側がいつ上書きしてもおかしくないので、呼び出し側がコピーしてから is_current(seq) で確認する。
+        :return: (frame, seq, timestamp)。まだ書き込まれていない場合は (None, 0, None)
+        """
+        for _ in range(2):
+            seq = int(self.latest[0])
+            if seq == 0:
+                return None, 0, None
+            slot = seq % self.slots
+            timestamp = float(self.timestamps[slot])
+            if self.slot_seq[slot] == seq:
+                return self.frames[slot], seq, timestamp
+        # 書き込みが追い越し続けている場合はあきらめる
+        return None, seq, None
+
+    def is_current(self, seq):
+        """seq のフレームがまだ上書きされていないかを返す"""
+        return self.slot_seq[seq % self.slots] == seq
+
+    def close(self):
+        # ビューが残っていると共有メモリを閉じられないので先に破棄する
+        del self.latest, self.slot_seq, self.timestamps, self.frames
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SharedFrameSource:
+    """
+    FrameRing から最新フレームを読むフレームソース
+
+    Camera と同じく get_frame() / read() / stats() / release() を持ち、FaceIdentification に
+    カメラの代わりに渡せる。
+
+    キャプチャのプロセスからの受け渡しはゼロコピーだが、読み込み側ではフレームごとに1回コピーする。
+    FaceIdentification は返したフレームに枠を描画し、プレビューのスレッドも保持し続けるので、
+    ビューのまま渡すと共有メモリに描画したり、表示中に書き込み側に上書きされたりするため。
+    コピーは 640×480 で 1 ms 未満と検出に比べて十分軽く、デコード済みのフレームを別のプロセスから
+    受け取れる利点 (キャプチャの GIL やデコードを検出のプロセスから切り離す) は変わらない。
+    """
+
+    def __init__(self, camera_index, wait_timeout=None):
+        """
+        :param camera_index: 接続するカメラ番号
+        :param wait_timeout: 書き込み側がリングを作成するまで待つ秒数 (省略時は config.FRAME_BUS_ATTACH_TIMEOUT)
+        """
+        self.index = camera_index
+        self.ring = self._attach(config.FRAME_BUS_ATTACH_TIMEOUT if wait_timeout is None else wait_timeout)
+        self.seq = 0
+        self.timestamp = None
+        self.last_read_seq = 0
+        self.captured_frames = 0
+        self.dropped_frames = 0
+        self.duplicate_frames = 0
+
+    def _attach(self, timeout):
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                return FrameRing(ring_name(self.index))
+            except FileNotFoundError:
+                if time.perf_counter() >= deadline:
+                    raise RuntimeError(f"❌ カメラ {self.index} のフレームバスに接続できませんでした。")
+                time.sleep(0.1)
+
+    def read(self, timeout=0.0):
+        view, seq, timestamp = self.ring.read_latest()
+        if view is None or seq == self.last_read_seq:
+            self.duplicate_frames += 1
+            return None, self.seq, self.timestamp
+
+        # コピーは検出に比べて十分軽い。コピー中に書き込み側が追い越した場合は壊れたフレームなので捨てる
+        frame = view.copy()
+        if not self.ring.is_current(seq):
+            self.dropped_frames += 1
+            return None, self.seq, self.timestamp
+
+        if self.last_read_seq:
+            self.dropped_frames += seq - self.last_read_seq - 1
+        self.captured_frames += seq - self.last_read_seq
+        self.last_read_seq = self.seq = seq
+        self.timestamp = timestamp
+        return frame, seq, timestamp
+
+    def get_frame(self):
+        frame, _, _ = self.read()
+        return frame
+
+    def stats(self):
+        return {
+            "captured": self.captured_frames,
+            "dropped": self.dropped_frames,
+            "duplicate": self.duplicate_frames,
+            "seq": self.seq,
+        }
+
+    def release(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+def run_producer(camera_index, stop_event):
+    """カメラから読み続けてリングに書き込む (キャプチャプロセスの本体)"""
+    # Ctrl+C は親プロセスが受け取り、stop_event で止める
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    camera = Camera(camera_index, threaded=False)
+    ring = FrameRing(ring_name(camera_index), create=True)
+    print(f"🎞️ Camera {camera_index} → shared memory '{ring.name}' ({ring.slots} slots)")
+    try:
+        while not stop_event.is_set():
+            seq, slot = ring.begin_write()
+            if camera.grab_into(slot):
+                ring.commit(seq, camera.timestamp)
+            else:
+                stop_event.wait(0.01)
+    finally:
+        camera.release()
+        ring.close()
+
+
+class CaptureProcesses:
+    """カメラごとにキャプチャプロセスを起動し、フレームバスに書き込ませる"""
+
+    def __init__(self, camera_indexes):
+        self.stop_event = multiprocessing.Event()
+        self.processes = [
+            multiprocessing.Process(
+                target=run_producer, args=(index, self.stop_event), name=f"Capture{index}", daemon=True
+            )
+            for index in camera_indexes
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+if __name__ == "__main__":
+    from discovery import resolve_camera_map
+
+    parser = argparse.ArgumentParser(description="カメラの映像を共有メモリのフレームバスに書き込み続ける")
+    parser.add_argument(
+        "camera_map",
+        nargs="?",
+        default=config.CAMERA_MAP,
+        help="camera_index:machine_id のカンマ区切り (例: 4:0,2:1,5:2,3:3)、auto の場合はカメラを探して決める",
+    )
+    args = parser.parse_args()
+
+    stop_event = threading.Event()
+    install_signal_handlers(stop_event)
+    capture = CaptureProcesses(resolve_camera_map(args.camera_map)).start()
+    try:
+        while not stop_event.wait(1.0):
+            if not any(process.is_alive() for process in capture.processes):
+                break
+    finally:
+        capture.stop()
+        print("🛑 Stopped capture.")
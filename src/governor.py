@@ -0,0 +1,132 @@
+import threading
+import time
+
+from config import config
+
+
+class CameraBudget:
+    """1台分の処理レートと検出解像度の状態"""
+
+    def __init__(self, machine_id):
+        self.machine_id = machine_id
+        self.fps = config.GOVERNOR_MAX_FPS  # 目標の処理レート
+        self.scale = 1.0  # 検出の入力の縮小率 (1.0 で min_face の設定どおり)
+        self.share = 0.0  # 割り当てた CPU 時間の割合
+        self.cost = None  # 1フレームの処理時間 (指数移動平均)
+        self.latency = None  # キャプチャから処理完了までの時間 (指数移動平均)
+        self.last_face_time = None
+        self.last_processed = 0.0
+        self.processed = 0
+        self.deferred = 0  # 読めた新しいフレームを処理せずに見送った数
+
+    def has_face(self, now):
+        return self.last_face_time is not None and now - self.last_face_time < config.GOVERNOR_FACE_HOLD
+
+
+def _ema(previous, value, alpha=0.2):
+    return value if previous is None else previous + alpha * (value - previous)
+
+
+class FrameGovernor:
+    """
+    全カメラで1つの CPU 時間の予算を分け合い、カメラごとの処理レートと検出解像度を決めるクラス
+
+    顔が見えているカメラには GOVERNOR_FACE_WEIGHT 倍の割合を与える。割り当てで GOVERNOR_MIN_FPS を
+    下回るカメラは検出の入力を縮小し、余裕ができたら戻す。処理の遅延が GOVERNOR_TARGET_LATENCY を
+    超えた場合は全体の予算を減らし (乗算)、余裕があれば少しずつ増やす (加算)。
+    """
+
+    def __init__(self):
+        self.target_latency = config.GOVERNOR_TARGET_LATENCY
+        self.utilization = config.GOVERNOR_UTILIZATION
+        self.load_factor = 1.0  # 遅延に応じて予算を絞る係数
+        self.cameras = {}
+        self.last_update = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def register(self, machine_id):
+        with self._lock:
+            return self.cameras.setdefault(machine_id, CameraBudget(machine_id))
+
+    def should_process(self, machine_id, now):
+        """このカメラの次のフレームを処理する時刻になっているかを返す"""
+        camera = self.cameras[machine_id]
+        return now - camera.last_processed >= 1.0 / camera.fps
+
+    def defer(self, machine_id):
+        """新しいフレームがあったが、順番が来ていないので処理せずに見送ったことを記録する"""
+        with self._lock:
+            self.cameras[machine_id].deferred += 1
+
+    def scale(self, machine_id):
+        """このカメラの検出の入力に掛ける縮小率を返す"""
+        return self.cameras[machine_id].scale
+
+    def record(self, machine_id, now, cost, latency, face_seen):
+        """
+        1フレーム処理した結果を記録し、一定間隔ごとに予算を配分し直す
+
+        :param now: 処理を始めた時刻 (time.time())
+        :param cost: 処理にかかった秒数
+        :param latency: キャプチャから処理完了までの秒数 (不明な場合は None)
+        :param face_seen: 顔が見えていたか
+        """
+        with self._lock:
+            camera = self.cameras[machine_id]
+            camera.last_processed = now
+            camera.processed += 1
+            camera.cost = _ema(camera.cost, cost)
+            if latency is not None:
+                camera.latency = _ema(camera.latency, latency)
+            if face_seen:
+                camera.last_face_time = now
+
+            clock = time.perf_counter()
+            if clock - self.last_update >= config.GOVERNOR_UPDATE_INTERVAL:
+                self.last_update = clock
+                self._rebalance(now)
+
+    def _rebalance(self, now):
+        cameras = [camera for camera in self.cameras.values() if camera.cost is not None]
+        if not cameras:
+            return
+
+        latencies = [camera.latency for camera in cameras if camera.latency is not None]
+        if latencies and max(latencies) > self.target_latency:
+            self.load_factor = max(0.1, self.load_factor * 0.8)
+        elif not latencies or max(latencies) < self.target_latency * 0.7:
+            self.load_factor = min(1.0, self.load_factor + 0.05)
+
+        budget = self.utilization * self.load_factor
+        weights = {
+            camera.machine_id: config.GOVERNOR_FACE_WEIGHT if camera.has_face(now) else 1.0
+            for camera in cameras
+        }
+        total_weight = sum(weights.values())
+        for camera in cameras:
+            camera.share = budget * weights[camera.machine_id] / total_weight
+            fps = camera.share / max(camera.cost, 1e-4)
+            if fps < config.GOVERNOR_MIN_FPS and camera.scale > config.GOVERNOR_MIN_SCALE:
+                # 割り当てでは最低限のレートも出せないので、検出の入力を縮小して1フレームを軽くする
+                camera.scale = max(config.GOVERNOR_MIN_SCALE, camera.scale * 0.8)
+            elif fps > config.GOVERNOR_MIN_FPS * 2 and camera.scale < 1.0:
+                camera.scale = min(1.0, camera.scale / 0.8)
+            camera.fps = min(config.GOVERNOR_MAX_FPS, max(config.GOVERNOR_MIN_FPS, fps))
+
+    def stats(self):
+        """カメラごとの現在の判断 (目標レート・縮小率・割合・処理時間・遅延・顔の有無) を返す"""
+        now = time.time()
+        with self._lock:
+            return {
+                machine_id: {
+                    "fps": camera.fps,
+                    "scale": camera.scale,
+                    "share": camera.share,
+                    "cost": camera.cost or 0.0,
+                    "latency": camera.latency or 0.0,
+                    "face": camera.has_face(now),
+                    "processed": camera.processed,
+                    "deferred": camera.deferred,
+                }
+                for machine_id, camera in self.cameras.items()
+            }
@@ -0,0 +1,340 @@
+import threading
+import time
+import cv2
+from api.sender import SenderTCP
+from camera import Camera
+from config import config
+from cpu_budget import apply_cpu_budget, session_options
+from detection import FaceDetector, parse_roi
+from governor import FrameGovernor
+from journal import Journal
+from metrics import metrics, startup
+from motion import MotionGate
+from preview import create_preview, install_signal_handlers
+from quality import FaceQualityGate
+from recognition import FaceRecognizer
+from tracking import FaceTracker
+
+
+class FaceDrawer:
+    """検出した顔に枠を描画するクラス"""
+
+    @staticmethod
+    def draw_face(frame, face, is_large):
+        """顔に枠を描画する"""
+        start = time.perf_counter()
+        x1, y1, x2, y2 = face
+        color = (0, 255, 0) if is_large else (0, 0, 255)  # 緑: 大きい顔, 赤: 小さい顔
+        thickness = 2
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
+        metrics.observe("draw", time.perf_counter() - start)
+
+
+class FaceIdentification:
+    """顔検出と識別の処理を管理するクラス"""
+
+    def __init__(self, input_cindex: int, output_cindex: int, detector=None, sender=None, game_state=None,
+                 recognizer=None, source=None, preview=None, governor=None, journal=None):
+        """
+        :param input_cindex: 入力カメラのインデックス
+        :param output_cindex: 送信先の machine_id (0~3)
+        :param detector: 共有する FaceDetector (省略時は新規に生成)
+        :param sender: 共有する SenderTCP (省略時は新規に生成)
+        :param game_state: ゲーム中に検出を間引くための GameState (省略時は常に全力で処理)
+        :param recognizer: 共有する FaceRecognizer (省略時は RECOGNITION_ENABLED の場合のみ生成)
+        :param source: カメラの代わりに使うフレームソース (sources.py 参照)
+        :param preview: フレームを表示する Preview (省略時は表示しない)
+        :param governor: カメラ間で共有する FrameGovernor (省略時は GOVERNOR_ENABLED の場合のみ生成)
+        :param journal: 検出結果を記録する Journal (省略時は JOURNAL_ENABLED の場合のみ生成)
+        """
+        if source is None:
+            with startup.phase(f"camera {input_cindex}"):
+                source = Camera(input_cindex)
+        self.camera = source
+        if detector is None:
+            with startup.phase("detector"):
+                detector = FaceDetector(session_options=session_options(apply_cpu_budget([output_cindex])))
+        self.detector = detector
+        self.sender = sender if sender is not None else SenderTCP()
+        if recognizer is None and config.RECOGNITION_ENABLED:
+            with startup.phase("recognizer"):
+                recognizer = FaceRecognizer()
+        self.recognizer = recognizer
+        # トラッキングが無効の場合も、毎フレーム検出した顔を人ごとに対応付けるためにトラッカーを使う
+        self.tracker = FaceTracker() if config.TRACKING_ENABLED else FaceTracker(detect_interval=1)
+        self.motion_gate = MotionGate(output_cindex) if config.MOTION_GATE_ENABLED else None
+        self.quality_gate = FaceQualityGate(output_cindex) if config.QUALITY_GATE_ENABLED else None
+        self.roi = parse_roi(config.per_camera("ROI", output_cindex))
+        self.min_face = config.per_camera("MIN_FACE_SIZE", output_cindex)
+        self.last_events = {}  # 照合した user_id ごとの最後の送信時刻
+        self.output_cindex = output_cindex
+        self.window_name = f"Camera{output_cindex:02d}"
+        self.game_state = game_state
+        self.game_version = game_state.get()[1] if game_state is not None else None
+        self.last_processed = 0.0
+        self.preview = preview
+        if governor is None and config.GOVERNOR_ENABLED:
+            governor = FrameGovernor()
+        self.governor = governor
+        if governor is not None:
+            governor.register(output_cindex)
+        if journal is None and config.JOURNAL_ENABLED:
+            journal = Journal()
+        self.journal = journal
+
+    def crop_roi(self, frame):
+        """ROI の部分だけを切り出す (コピーしない)"""
+        if self.roi is None:
+            return frame
+        x, y, w, h = self.roi
+        return frame[y:y + h, x:x + w]
+
+    def locate_faces(self, frame):
+        """
+        検出モデルまたはオプティカルフローで、見えている顔のトラックを求める
+
+        :return: Track のリスト。kps は検出モデルを実行したフレームのみ
+        """
+        if not self.tracker.needs_detection():
+            return self.tracker.propagate(frame)
+
+        boxes, scores, kpss = self.detector.detect_faces(frame, self.roi, self.detection_min_face())
+        return self.tracker.update(frame, boxes, scores, kpss)
+
+    def update_identity(self, track, frame, current_time):
+        """
+        トラックごとに1回だけ埋め込みを計算し、照合を開始する
+
+        品質ゲートが有効な場合は QUALITY_WINDOW 秒の間で最も品質の良い顔を使い、無効な場合は最初の顔を使う。
+        :return: 送信の対象にしてよい顔 (品質ゲートを通過した顔) であれば True
+        """
+        if self.quality_gate is None:
+            if self.recognizer is not None and track.identity is None and track.kps is not None:
+                track.identity = self.recognizer.submit(self.detector.get_embedding(frame, track.kps))
+            return True
+
+        ready = self.quality_gate.update(track, frame, current_time)
+        # ランドマークがない場合は切り出せないので照合しない (resolve_user_id がタイムアウトで DEFAULT_USER_ID にする)
+        if ready and self.recognizer is not None and track.identity is None and track.best_kps is not None:
+            track.identity = self.recognizer.submit(self.detector.get_embedding(track.best_crop, track.best_kps))
+            track.best_crop = None
+        return ready
+
+    def detection_min_face(self):
+        """検出に使う最小の顔の大きさ。ガバナーが入力を縮小している場合はその分だけ大きくする"""
+        if self.governor is None:
+            return self.min_face
+        scale = self.governor.scale(self.output_cindex)
+        if scale >= 1.0:
+            return self.min_face
+        return (self.min_face or config.DET_MIN_FACE_PX) / scale
+
+    def resolve_user_id(self, track, elapsed_time):
+        """
+        送信する user_id を返す
+
+        :return: 照合済みの user_id。照合を待つ間は None、認識が無効または失敗した場合は DEFAULT_USER_ID
+        """
+        if self.recognizer is None:
+            return config.DEFAULT_USER_ID
+
+        identity = track.identity
+        if identity is not None and identity.done():
+            try:
+                return identity.result()
+            except Exception as e:
+                print(f"❌ Recognition Error: {e}")
+                return config.DEFAULT_USER_ID
+
+        if elapsed_time > config.FACE_PERSIST_THRESHOLD + config.RECOGNITION_TIMEOUT:
+            print("⚠️ Recognition timed out.")
+            return config.DEFAULT_USER_ID
+        return None
+
+    def recently_sent(self, user_id, current_time):
+        """
+        照合できた同じ人に EVENT_COOLDOWN 秒以内に送信済みかを返す
+
+        トラックが途切れて別のトラックになっても、同じ人への送信は重複させない。
+        DEFAULT_USER_ID は別の人でも同じ値なので対象にしない。
+        """
+        if self.recognizer is None or user_id == config.DEFAULT_USER_ID:
+            return False
+        last_event = self.last_events.get(user_id)
+        if last_event is not None and current_time - last_event < config.EVENT_COOLDOWN:
+            return True
+        self.last_events[user_id] = current_time
+        return False
+
+    def process_frame(self, frame):
+        """フレームから顔を検出し、条件を満たした顔ごとにデータ送信"""
+        current_time = time.time()
+        if self.motion_gate is not None and not self.motion_gate.should_detect(self.crop_roi(frame), current_time):
+            # 静止したシーンでは検出モデルを実行しない (しばらく顔が見えていないので追跡中の顔も破棄する)
+            if self.tracker.tracks:
+                self.tracker.reset()
+            return
+
+        tracks = self.locate_faces(frame)
+        if tracks and self.motion_gate is not None:
+            self.motion_gate.face_seen(current_time)
+        for track in tracks:
+            self.process_track(frame, track, current_time)
+        # 品質の判定と埋め込みがほかの顔の枠を含まないように、すべての顔を処理してから描画する
+        self.draw_tracks(frame, tracks)
+        if self.journal is not None and (tracks or config.JOURNAL_RECORD_EMPTY):
+            self.journal.record_frame(self.output_cindex, current_time, tracks)
+
+    @staticmethod
+    def draw_tracks(frame, tracks):
+        """トラックの枠をまとめて描画する"""
+        for track in tracks:
+            FaceDrawer.draw_face(frame, track.bbox(), track.large)
+
+    def process_track(self, frame, track, current_time):
+        """
+        1つの顔の継続時間を数え、FACE_PERSIST_THRESHOLD を超えたら送信する
+
+        大きさの判定にはヒステリシスを持たせ、しきい値付近で継続時間がリセットされ続けないようにする。
+        送信後は EVENT_COOLDOWN 秒間、同じトラックには送信しない。
+        """
+        threshold = config.FACE_SIZE_THRESHOLD
+        if track.large:
+            threshold *= config.FACE_SIZE_HYSTERESIS
+        track.large = track.area() > threshold
+
+        if not track.large:
+            track.persist_start = None
+            return
+
+        # 枠は process_frame がすべての顔の処理を終えてから描画するので、ここでのフレームには枠がない
+        ready = self.update_identity(track, frame, current_time)
+
+        if track.persist_start is None:
+            track.persist_start = current_time
+            return
+        if not ready:
+            # 品質の閾値を満たす顔がまだ写っていない (ぼやけている・横を向いている・暗いなど)
+            return
+        elapsed_time = current_time - track.persist_start
+        if elapsed_time <= config.FACE_PERSIST_THRESHOLD:
+            return
+        if track.last_event is not None and current_time - track.last_event < config.EVENT_COOLDOWN:
+            return
+
+        user_id = self.resolve_user_id(track, elapsed_time)
+        if user_id is None:
+            return
+        track.last_event = current_time
+        if self.recently_sent(user_id, current_time):
+            metrics.inc("events_deduplicated")
+            return
+        self.sender.send_request("attract", user_id, self.output_cindex)
+        if self.journal is not None:
+            self.journal.record_event(self.output_cindex, current_time, track, user_id)
+        print(f"📡 Data {'queued' if self.sender.async_mode else 'sent'}: '{user_id}' (track {track.track_id})")
+
+    def is_paused(self):
+        """ゲーム中で、検出を完全に止めるモードかどうかを返す"""
+        return (
+            self.game_state is not None
+            and self.game_state.is_active()
+            and config.GAME_ACTIVE_MODE == "pause"
+        )
+
+    def should_process(self, now):
+        """ゲーム中は GAME_ACTIVE_INTERVAL 秒に1フレームだけ処理する"""
+        if self.game_state is None or not self.game_state.is_active():
+            return True
+        if config.GAME_ACTIVE_MODE == "pause":
+            return False
+        return now - self.last_processed >= config.GAME_ACTIVE_INTERVAL
+
+    def sync_game_state(self):
+        """ゲーム状態が変わっていれば、追跡中の顔と継続時間をリセットする"""
+        status, version = self.game_state.get()
+        if version == self.game_version:
+            return
+        self.game_version = version
+        self.tracker.reset()
+        mode = "full rate" if status != "ACTIVE" else config.GAME_ACTIVE_MODE
+        print(f"🎮 {self.window_name}: game {status}, detection {mode}")
+
+    def step(self):
+        """1フレーム分の取得・識別・表示を行う。フレームを処理した場合は True を返す"""
+        with metrics.camera(self.output_cindex):
+            return self._step()
+
+    def _step(self):
+        if self.game_state is not None:
+            self.sync_game_state()
+        if self.is_paused():
+            # 最新フレームはキャプチャスレッドが保持しているので、再開時にすぐ処理できる
+            return False
+
+        frame = self.camera.get_frame()
+        if frame is None:
+            return False
+
+        now = time.time()
+        processed = self.should_process(now)
+        if processed and self.governor is not None and not self.governor.should_process(self.output_cindex, now):
+            # 割り当てられたレートの順番が来ていないので、このフレームは表示だけにする
+            self.governor.defer(self.output_cindex)
+            processed = False
+            if self.preview is not None:
+                # 処理したフレームとの間で枠がちらつかないように、直近の枠を描画しておく
+                self.draw_tracks(frame, self.tracker.visible())
+        if processed:
+            self.last_processed = now
+            start = time.perf_counter()
+            self.process_frame(frame)
+            metrics.inc("frames_processed")
+            if self.governor is not None:
+                timestamp = getattr(self.camera, "timestamp", None)
+                self.governor.record(
+                    self.output_cindex, now, time.perf_counter() - start,
+                    time.time() - timestamp if timestamp else None,
+                    bool(self.tracker.visible()),
+                )
+
+        if self.preview is not None:
+            start = time.perf_counter()
+            self.preview.publish(self.window_name, frame)
+            metrics.observe("display", time.perf_counter() - start)
+        return processed
+
+    def warmup(self):
+        """このカメラの ROI と縮小率でダミーのフレームを推論しておく"""
+        self.detector.warmup(self.roi, self.min_face, recognition=self.recognizer is not None)
+
+    def release(self):
+        """カメラを解放する"""
+        self.camera.release()
+
+    def run(self):
+        """カメラのフレームを取得し続け、顔識別処理を実行"""
+        print(f"🚀 Starting identification({self.window_name})...")
+
+        stop_event = threading.Event()
+        install_signal_handlers(stop_event)
+        if self.preview is None:
+            self.preview = create_preview(on_close=stop_event.set)
+        if config.WARMUP_ENABLED:
+            with startup.phase("warm-up"):
+                self.warmup()
+        startup.report()
+
+        try:
+            while not stop_event.is_set():
+                if not self.step():
+                    # 新しいフレームがない間は CPU を使い切らないように少し待つ
+                    stop_event.wait(0.001)
+        finally:
+            self.release()
+            self.sender.close()
+            if self.journal is not None:
+                self.journal.close()
+            if self.preview is not None:
+                self.preview.stop()
+            print("🛑 Stopped identification.")
@@ -0,0 +1,255 @@
+import argparse
+import glob
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from config import config
+
+MAGIC = b"VCJRNL02"
+HEADER = struct.Struct("<8sI")
+HEADER_SIZE = 64  # ヘッダーの後ろはレコードが並ぶだけなので、memmap の offset に使う
+MAX_FACES = 8  # 1レコードに入れる顔の数 (ファイルの形式を固定するため設定にはしない)
+
+FRAME = 0  # 検出結果
+EVENT = 1  # ゲームサーバーに送信したイベント
+
+RECORD_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("run_id", "<u8"),  # Journal ごとの乱数。track_id はプロセスごとに 1 から振り直されるので、人の区別に使う
+    ("camera", "u1"),  # machine_id
+    ("kind", "u1"),  # FRAME / EVENT
+    ("face_count", "<u2"),  # MAX_FACES を超えた分も数える
+    ("track_ids", "<u4", (MAX_FACES,)),
+    ("boxes", "<f4", (MAX_FACES, 4)),  # [x1, y1, x2, y2]
+    ("scores", "<f4", (MAX_FACES,)),
+    ("user_id", "S40"),  # EVENT の場合のみ
+])
+
+
+class Journal:
+    """
+    フレームごとの検出結果と送信したイベントを、固定長のバイナリレコードで追記するクラス
+
+    呼び出し側はキューに入れるだけで戻り、書き込みはバックグラウンドのスレッドが行う。
+    キューが一杯の場合 (ディスクが遅いなど) はレコードを捨て、カメラのループを待たせない。
+    ファイルが JOURNAL_MAX_BYTES を超えたら新しいファイルに切り替え、JOURNAL_MAX_FILES を超えた古いものは消す。
+    """
+
+    def __init__(self, directory=None):
+        """
+        :param directory: 書き込むディレクトリ (省略時は config.JOURNAL_DIR)
+        """
+        self.directory = os.path.expanduser(directory or config.JOURNAL_DIR)
+        os.makedirs(self.directory, exist_ok=True)
+        self.queue = queue.Queue(maxsize=config.JOURNAL_QUEUE_SIZE)
+        self.file = None
+        self.path = None
+        self.file_index = 0
+        self.run_id = int.from_bytes(os.urandom(8), "little")
+        self.written = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._writer_loop, name="Journal", daemon=True)
+        self._thread.start()
+
+    def record_frame(self, camera, timestamp, tracks):
+        """処理したフレームで見えている顔 (Track のリスト) を記録する"""
+        faces = [(track.track_id, track.box, track.score) for track in tracks]
+        self._put((FRAME, timestamp, camera, faces, None))
+
+    def record_event(self, camera, timestamp, track, user_id):
+        """送信したイベントを、対象の顔と一緒に記録する"""
+        self._put((EVENT, timestamp, camera, [(track.track_id, track.box, track.score)], user_id))
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # 複数のカメラのスレッドから呼ばれる
+            with self._lock:
+                self.dropped += 1
+
+    def _open_file(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        # 同じ秒に切り替えたり別の Journal が開いたりしても上書きしないように、実行 ID と通し番号を付ける
+        name = f"journal-{stamp}-{os.getpid()}-{self.run_id:016x}-{self.file_index:04d}.vcj"
+        self.path = os.path.join(self.directory, name)
+        self.file_index += 1
+        self.file = open(self.path, "wb")
+        self.file.write(HEADER.pack(MAGIC, RECORD_DTYPE.itemsize).ljust(HEADER_SIZE, b"\0"))
+
+    def _rotate(self):
+        self.file.close()
+        self._open_file()
+        files = sorted(journal_files(self.directory), key=os.path.getmtime)
+        for path in files[:max(0, len(files) - config.JOURNAL_MAX_FILES)]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"⚠️ Could not remove old journal {path}: {e}")
+
+    def _writer_loop(self):
+        self._open_file()
+        while True:
+            items = [self.queue.get()]
+            # 溜まっている分はまとめて1回で書き込む
+            while len(items) < 1024:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in items
+            items = [item for item in items if item is not None]
+            if items:
+                self._write(items)
+            if stop:
+                self.file.close()
+                return
+            if self.file.tell() >= config.JOURNAL_MAX_BYTES:
+                self._rotate()
+
+    def _write(self, items):
+        records = np.zeros(len(items), dtype=RECORD_DTYPE)
+        records["run_id"] = self.run_id
+        for row, (kind, timestamp, camera, faces, user_id) in enumerate(items):
+            records["timestamp"][row] = timestamp
+            records["camera"][row] = camera
+            records["kind"][row] = kind
+            records["face_count"][row] = len(faces)
+            for i, (track_id, box, score) in enumerate(faces[:MAX_FACES]):
+                records["track_ids"][row, i] = track_id
+                records["boxes"][row, i] = box
+                records["scores"][row, i] = score
+            if user_id is not None:
+                records["user_id"][row] = str(user_id).encode()[:RECORD_DTYPE["user_id"].itemsize]
+        self.file.write(records.tobytes())
+        self.file.flush()
+        self.written += len(items)
+
+    def stats(self):
+        """書き込んだレコード数と、キューが一杯で捨てたレコード数を返す"""
+        return {"written": self.written, "dropped": self.dropped, "queue_depth": self.queue.qsize()}
+
+    def close(self, timeout=2.0):
+        """キューに残っているレコードを書き込んでから閉じる"""
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+
+def journal_files(directory=None):
+    """ディレクトリ内のジャーナルを古い順に返す"""
+    directory = os.path.expanduser(directory or config.JOURNAL_DIR)
+    return sorted(glob.glob(os.path.join(directory, "journal-*.vcj")))
+
+
+def open_journal(path):
+    """
+    ジャーナル1つを読み取り専用の NumPy memmap として開く
+
+    書き込み中のファイルでも、書き終わっているレコードまでを返す。
+    :return: RECORD_DTYPE の配列
+    """
+    with open(path, "rb") as file:
+        magic, itemsize = HEADER.unpack(file.read(HEADER.size))
+    if magic != MAGIC or itemsize != RECORD_DTYPE.itemsize:
+        raise ValueError(f"❌ {path} はこのバージョンのジャーナルではありません。")
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if count <= 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+def load_journal(directory=None):
+    """ディレクトリ内のすべてのジャーナルを時刻順の1つの配列にまとめる"""
+    parts = [open_journal(path) for path in journal_files(directory)]
+    if not parts:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    records = np.concatenate(parts)
+    return records[np.argsort(records["timestamp"], kind="stable")]
+
+
+def summarize_journal(records):
+    """
+    カメラごとのフレーム数・顔が写っていたフレーム数・人数 (実行と track_id の組の数)・イベント数を返す
+
+    :return: {camera: {...}}
+    """
+    summary = {}
+    for camera in np.unique(records["camera"]):
+        rows = records[records["camera"] == camera]
+        frames = rows[rows["kind"] == FRAME]
+        events = rows[rows["kind"] == EVENT]
+        counts = np.minimum(frames["face_count"], MAX_FACES)
+        valid = np.arange(MAX_FACES)[None, :] < counts[:, None]
+        # 同じ track_id でも、別の実行 (再起動の前後など) なら別の人として数える
+        runs = np.broadcast_to(frames["run_id"][:, None], valid.shape)[valid]
+        people = np.unique(np.stack([runs, frames["track_ids"][valid].astype(np.uint64)], axis=1), axis=0)
+        hours = float(rows["timestamp"].max() - rows["timestamp"].min()) / 3600 if len(rows) > 1 else 0.0
+        summary[int(camera)] = {
+            "frames": len(frames),
+            "frames_with_faces": int((frames["face_count"] > 0).sum()),
+            "people": len(people),
+            "events": len(events),
+            "events_per_hour": len(events) / hours if hours > 0 else 0.0,
+        }
+    return summary
+
+
+def replay_events(records, sender, speed=1.0):
+    """
+    記録したイベントを元の間隔 (speed 倍速) で sender から送り直す
+
+    :param sender: SenderTCP (スタブのゲームサーバーに向けたもの)
+    :param speed: 再生速度。0 以下の場合は待たずに送る
+    :return: 送信したイベント数
+    """
+    events = records[records["kind"] == EVENT]
+    events = events[np.argsort(events["timestamp"], kind="stable")]
+    start_clock = time.perf_counter()
+    for event in events:
+        if speed > 0:
+            due = (event["timestamp"] - events[0]["timestamp"]) / speed
+            delay = due - (time.perf_counter() - start_clock)
+            if delay > 0:
+                time.sleep(delay)
+        sender.send_request("attract", event["user_id"].decode(), int(event["camera"]))
+    return len(events)
+
+
+if __name__ == "__main__":
+    from api.sender import SenderTCP
+
+    parser = argparse.ArgumentParser(description="検出結果のジャーナルを集計・再生する")
+    parser.add_argument("command", choices=["summary", "replay"])
+    parser.add_argument("directory", nargs="?", default=config.JOURNAL_DIR)
+    parser.add_argument("--speed", type=float, default=1.0, help="再生速度 (0 の場合は待たずに送る)")
+    parser.add_argument("--stub", action="store_true", help="スタブのゲームサーバーを起動してそこへ送る")
+    args = parser.parse_args()
+
+    records = load_journal(args.directory)
+    if args.command == "summary":
+        print(f"📒 {len(records)} records in {len(journal_files(args.directory))} files")
+        for camera, stats in summarize_journal(records).items():
+            print(
+                f"Camera{camera:02d}: {stats['frames']} frames, {stats['frames_with_faces']} with faces, "
+                f"{stats['people']} people, {stats['events']} events ({stats['events_per_hour']:.1f}/h)"
+            )
+    else:
+        stub = None
+        sender = SenderTCP(async_mode=False)
+        if args.stub:
+            from benchmark import StubGameServer
+
+            stub = StubGameServer().start()
+            sender.server_ip, sender.server_port = "127.0.0.1", stub.port
+        count = replay_events(records, sender, args.speed)
+        sender.close()
+        print(f"🔁 Replayed {count} events to {sender.server_ip}:{sender.server_port}")
+        if stub is not None:
+            print(f"📥 Stub server received {len(stub.events)} events")
+            stub.stop()
@@ -0,0 +1,74 @@
+import time
+
+import cv2
+
+from config import config
+
+
+class MotionGate:
+    """縮小したグレースケール画像の背景差分で、検出モデルを実行すべきかを判定するクラス"""
+
+    def __init__(self, machine_id):
+        """
+        :param machine_id: カメラ別の閾値 (例: MOTION_AREA_RATIO_0) を読むための machine_id
+        """
+        self.pixel_threshold = config.per_camera("MOTION_PIXEL_THRESHOLD", machine_id)
+        self.area_ratio = config.per_camera("MOTION_AREA_RATIO", machine_id)
+        self.hold_time = config.per_camera("MOTION_HOLD_TIME", machine_id)
+        self.scale_width = config.MOTION_SCALE_WIDTH
+        self.alpha = config.MOTION_BG_ALPHA
+
+        self.background = None
+        self.last_face_time = None
+        self.motion_ratio = 0.0
+
+        self.inferences = 0
+        self.skipped = 0
+        self.gate_cpu_time = 0.0
+
+    def should_detect(self, frame, now):
+        """
+        前回までの背景と比べて十分な変化があるか、最近顔が見えていれば True を返す
+
+        :param frame: BGR フレーム
+        :param now: 現在時刻 (time.time())
+        """
+        start = time.thread_time()
+
+        h, w = frame.shape[:2]
+        size = (self.scale_width, max(1, h * self.scale_width // w))
+        gray = cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0).astype("float32")
+
+        if self.background is None:
+            self.background = gray
+            self.motion_ratio = 1.0
+        else:
+            diff = cv2.absdiff(gray, self.background)
+            self.motion_ratio = cv2.countNonZero((diff > self.pixel_threshold).astype("uint8")) / diff.size
+            cv2.accumulateWeighted(gray, self.background, self.alpha)
+
+        face_recent = self.last_face_time is not None and now - self.last_face_time < self.hold_time
+        passed = face_recent or self.motion_ratio >= self.area_ratio
+
+        if passed:
+            self.inferences += 1
+        else:
+            self.skipped += 1
+        self.gate_cpu_time += time.thread_time() - start
+        return passed
+
+    def face_seen(self, now):
+        """顔が見えた時刻を記録し、しばらくゲートを開いたままにする"""
+        self.last_face_time = now
+
+    def stats(self):
+        """ゲートの判定回数と CPU 時間を返す"""
+        total = self.inferences + self.skipped
+        return {
+            "inferences": self.inferences,
+            "skipped": self.skipped,
+            "skip_ratio": self.skipped / total if total else 0.0,
+            "motion_ratio": self.motion_ratio,
+            "gate_cpu_time": self.gate_cpu_time,
+        }
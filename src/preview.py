@@ -0,0 +1,231 @@
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+from config import config
+
+
+def install_signal_handlers(stop_event):
+    """SIGINT / SIGTERM (Windows では SIGBREAK も) を受け取ったら stop_event をセットする"""
+
+    def handle(signum, _frame):
+        print(f"🛑 Received signal {signal.Signals(signum).name}, shutting down...")
+        stop_event.set()
+
+    for name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), handle)
+
+
+def downscale(frame, width):
+    """幅が width を超える場合のみ縦横比を保って縮小する"""
+    h, w = frame.shape[:2]
+    if width <= 0 or w <= width:
+        return frame
+    return cv2.resize(frame, (width, int(h * width / w)), interpolation=cv2.INTER_AREA)
+
+
+class Preview:
+    """
+    識別ループからフレームを受け取り、別スレッドで表示するプレビューの共通処理
+
+    publish() は間引き判定と参照の保持だけを行い、縮小・表示・エンコードは呼び出し側のスレッドでは行わない。
+    """
+
+    def __init__(self, fps=None, width=None):
+        """
+        :param fps: カメラごとの最大表示フレームレート (省略時は config.PREVIEW_FPS)
+        :param width: 表示する幅 (省略時は config.PREVIEW_WIDTH)
+        """
+        self.interval = 1.0 / (config.PREVIEW_FPS if fps is None else fps)
+        self.width = config.PREVIEW_WIDTH if width is None else width
+        self.frames = {}  # name -> (seq, frame)
+        self.last_publish = {}  # name -> 最後に publish された時刻
+        self.condition = threading.Condition()
+        self.running = True
+
+    def wants(self, name):
+        """name のフレームを今受け取る必要があるかを返す"""
+        return True
+
+    def publish(self, name, frame):
+        """最新フレームを渡す。間隔が短すぎる場合や不要な場合は何もしない"""
+        now = time.perf_counter()
+        if now - self.last_publish.get(name, 0.0) < self.interval:
+            return
+        self.last_publish[name] = now
+        if not self.wants(name):
+            return
+        with self.condition:
+            seq = self.frames[name][0] + 1 if name in self.frames else 1
+            self.frames[name] = (seq, frame)
+            self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+
+class WindowPreview(Preview):
+    """表示スレッドで cv2.imshow する。ウィンドウで ESC が押されたら on_close を呼ぶ"""
+
+    def __init__(self, on_close=None, fps=None, width=None):
+        super().__init__(fps, width)
+        self.on_close = on_close
+        self.thread = threading.Thread(target=self._display_loop, name="Preview", daemon=True)
+        self.thread.start()
+
+    def _display_loop(self):
+        shown = {}  # name -> 表示済みの seq
+        while self.running:
+            with self.condition:
+                pending = [
+                    (name, frame) for name, (seq, frame) in self.frames.items() if shown.get(name) != seq
+                ]
+                for name, (seq, _) in self.frames.items():
+                    shown[name] = seq
+
+            for name, frame in pending:
+                cv2.imshow(name, downscale(frame, self.width))
+
+            # waitKey は GUI のイベント処理と次のフレームまでの待機を兼ねる
+            if cv2.waitKey(max(1, int(self.interval * 1000))) & 0xFF == 27:  # ESCキーで終了
+                if self.on_close is not None:
+                    self.on_close()
+        cv2.destroyAllWindows()
+
+    def stop(self):
+        super().stop()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+
+
+class MJPEGPreview(Preview):
+    """
+    http://host:port/<name>.mjpg でフレームを MJPEG として配信する
+
+    接続中のクライアントがいるカメラのフレームだけを受け取り、JPEG へのエンコードは配信スレッドで
+    1フレームにつき1回だけ行う。
+    """
+
+    def __init__(self, host=None, port=None, fps=None, width=None, quality=None):
+        super().__init__(fps, width)
+        self.quality = config.PREVIEW_JPEG_QUALITY if quality is None else quality
+        self.clients = {}  # name -> 接続数
+        self.encoded = {}  # name -> (seq, jpeg)
+        self._encode_lock = threading.Lock()
+
+        preview = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.strip("/")
+                if name == "":
+                    preview._send_index(self)
+                elif name.endswith(".mjpg"):
+                    preview._stream(self, name[:-len(".mjpg")])
+                else:
+                    self.send_error(404)
+
+            def log_message(self, format, *args):
+                pass
+
+        host = host or config.PREVIEW_HOST
+        port = config.PREVIEW_PORT if port is None else port
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="Preview", daemon=True).start()
+        print(f"🖥️ Preview available at http://{host}:{self.server.server_address[1]}/")
+
+    def wants(self, name):
+        return self.clients.get(name, 0) > 0
+
+    def _jpeg(self, name, seq, frame):
+        """最新フレームの JPEG を返す。同じフレームを複数のクライアントで使い回す"""
+        with self._encode_lock:
+            cached = self.encoded.get(name)
+            if cached is not None and cached[0] == seq:
+                return cached[1]
+            ok, buffer = cv2.imencode(
+                ".jpg", downscale(frame, self.width), [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+            )
+            jpeg = buffer.tobytes() if ok else None
+            self.encoded[name] = (seq, jpeg)
+            return jpeg
+
+    def _send_index(self, handler):
+        with self.condition:
+            names = sorted(self.last_publish)
+        body = "".join(f'<h3>{name}</h3><img src="/{name}.mjpg">' for name in names).encode()
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/html; charset=utf-8")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _stream(self, handler, name):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        handler.end_headers()
+
+        with self.condition:
+            self.clients[name] = self.clients.get(name, 0) + 1
+        sent_seq = None
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(
+                        lambda: not self.running or self.frames.get(name, (None,))[0] not in (None, sent_seq),
+                        timeout=1.0,
+                    )
+                    if not self.running:
+                        return
+                    if name not in self.frames or self.frames[name][0] == sent_seq:
+                        continue
+                    sent_seq, frame = self.frames[name]
+
+                jpeg = self._jpeg(name, sent_seq, frame)
+                if jpeg is None:
+                    continue
+                handler.wfile.write(
+                    b"--frame\r\nContent-Type: image/jpeg\r\n"
+                    + f"Content-Length: {len(jpeg)}\r\n\r\n".encode()
+                    + jpeg
+                    + b"\r\n"
+                )
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self.condition:
+                self.clients[name] -= 1
+                if self.clients[name] == 0:
+                    # 誰も見ていない間は古いフレームを保持しない
+                    self.frames.pop(name, None)
+                    with self._encode_lock:
+                        self.encoded.pop(name, None)
+
+    def stop(self):
+        super().stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def create_preview(on_close=None):
+    """
+    config.PREVIEW_MODE に応じたプレビューを生成する
+
+    :param on_close: ウィンドウで ESC が押されたときに呼ぶ関数 (window モードのみ)
+    :return: Preview。none (ヘッドレス) の場合は None
+    """
+    mode = config.PREVIEW_MODE
+    if mode == "window":
+        return WindowPreview(on_close=on_close)
+    if mode == "mjpeg":
+        return MJPEGPreview()
+    if mode != "none":
+        print(f"⚠️ Unknown PREVIEW_MODE '{mode}', running headless.")
+    return None
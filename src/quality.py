@@ -0,0 +1,130 @@
+import cv2
+import numpy as np
+
+from config import config
+
+QUALITY_SIZE = 64  # 鮮明さ・明るさを測る前に顔を縮小する大きさ (px)
+SHARPNESS_REFERENCE = 120.0  # スコアで十分に鮮明とみなすラプラシアンの分散 (閾値を 0 にしても使える固定の基準)
+
+
+def estimate_pose(kps):
+    """
+    5点ランドマーク (右目・左目・鼻・口右・口左) からおおよその顔の向きを求める
+
+    目を結ぶ線を水平に回した座標で、鼻が目の中点からどれだけずれているかを測る。
+    :return: (yaw, pitch)。正面で (0, 0)、yaw は目の間隔、pitch は目と口の距離に対する比率
+    """
+    eye_r, eye_l, nose, mouth_r, mouth_l = np.asarray(kps, dtype=np.float32)
+    axis = eye_l - eye_r
+    eye_dist = float(np.linalg.norm(axis))
+    if eye_dist < 1e-3:
+        return 1.0, 1.0
+    ux = axis / eye_dist
+    uy = np.array([-ux[1], ux[0]], dtype=np.float32)
+
+    eye_mid = (eye_r + eye_l) / 2
+    mouth_mid = (mouth_r + mouth_l) / 2
+    face_height = float(np.dot(mouth_mid - eye_mid, uy))
+    yaw = float(np.dot(nose - eye_mid, ux)) / eye_dist
+    # 正面では鼻は目と口のおよそ中間にある
+    pitch = float(np.dot(nose - eye_mid, uy)) / face_height - 0.5 if face_height > 1e-3 else 1.0
+    return yaw, pitch
+
+
+def crop_face(frame, box, kps, margin=0.5):
+    """
+    枠の周りを少し広げて顔を切り出し (コピー)、ランドマークを切り出した画像の座標に直す
+
+    元のフレームを保持せずに、あとからこの画像で埋め込みを計算できる。
+    :return: (crop, kps)
+    """
+    h, w = frame.shape[:2]
+    x1, y1, x2, y2 = box
+    pad_x, pad_y = (x2 - x1) * margin, (y2 - y1) * margin
+    left, top = max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y))
+    right, bottom = min(w, int(x2 + pad_x)), min(h, int(y2 + pad_y))
+    crop = frame[top:bottom, left:right].copy()
+    return crop, (kps - np.array([left, top], dtype=np.float32)) if kps is not None else None
+
+
+class FaceQualityGate:
+    """鮮明さ・顔の向き・明るさ・検出スコアから、認識や送信に使える顔かどうかを判定するクラス"""
+
+    def __init__(self, machine_id):
+        """
+        :param machine_id: カメラ別の閾値 (例: QUALITY_MIN_SHARPNESS_0) を読むための machine_id
+        """
+        self.min_sharpness = config.per_camera("QUALITY_MIN_SHARPNESS", machine_id)
+        self.max_yaw = config.per_camera("QUALITY_MAX_YAW", machine_id)
+        self.max_pitch = config.per_camera("QUALITY_MAX_PITCH", machine_id)
+        self.min_brightness = config.per_camera("QUALITY_MIN_BRIGHTNESS", machine_id)
+        self.max_brightness = config.per_camera("QUALITY_MAX_BRIGHTNESS", machine_id)
+        self.min_det_score = config.per_camera("QUALITY_MIN_DET_SCORE", machine_id)
+        self.window = config.QUALITY_WINDOW
+
+        self.assessed = 0
+        self.rejected = 0
+
+    def assess(self, frame, box, kps, det_score):
+        """
+        顔1つの品質を測る
+
+        :param box: 顔の枠 [x1, y1, x2, y2]
+        :param kps: 5点ランドマーク (5, 2)。None の場合は向きを判定しない
+        :param det_score: 検出モデルのスコア
+        :return: (score, passed)。score は 0~1 (大きいほど良い)、passed はすべての閾値を満たすか
+        """
+        h, w = frame.shape[:2]
+        x1, y1, x2, y2 = (int(v) for v in box)
+        face = frame[max(0, y1):min(h, y2), max(0, x1):min(w, x2)]
+        if face.size == 0:
+            return 0.0, False
+
+        # 縮小してから測ると、顔の大きさによらず同じ基準で比べられて計算も軽い
+        gray = cv2.cvtColor(cv2.resize(face, (QUALITY_SIZE, QUALITY_SIZE), interpolation=cv2.INTER_AREA),
+                            cv2.COLOR_BGR2GRAY)
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+        brightness = float(gray.mean())
+        yaw, pitch = estimate_pose(kps) if kps is not None else (0.0, 0.0)
+
+        passed = (
+            sharpness >= self.min_sharpness
+            and abs(yaw) <= self.max_yaw
+            and abs(pitch) <= self.max_pitch
+            and self.min_brightness <= brightness <= self.max_brightness
+            and det_score >= self.min_det_score
+        )
+        score = (
+            det_score
+            * min(1.0, sharpness / SHARPNESS_REFERENCE)
+            * max(0.0, 1.0 - abs(yaw))
+            * max(0.0, 1.0 - abs(pitch))
+        )
+
+        self.assessed += 1
+        if not passed:
+            self.rejected += 1
+        return score, passed
+
+    def update(self, track, frame, now):
+        """
+        検出モデルを実行したフレームで顔の品質を測り、トラックの最良の切り出し画像を更新する
+
+        :return: QUALITY_WINDOW 秒の候補期間が終わり、最良の顔が決まっていれば True
+        """
+        if track.quality_start is not None and now - track.quality_start >= self.window:
+            # 候補期間が終わったトラックはもう測らない
+            return True
+        if track.detected:
+            # ランドマークのない検出モデルでは、向き以外の項目だけで判定する
+            score, passed = self.assess(frame, track.box, track.kps, track.score)
+            if passed and score > track.best_quality:
+                if track.quality_start is None:
+                    track.quality_start = now
+                track.best_quality = score
+                track.best_crop, track.best_kps = crop_face(frame, track.box, track.kps)
+        return False
+
+    def stats(self):
+        """品質を測った顔の数と、閾値を満たさなかった数を返す"""
+        return {"assessed": self.assessed, "rejected": self.rejected}
@@ -0,0 +1,213 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from config import config
+
+
+class NumpyIndex:
+    """総当たりのコサイン類似度で検索するプロセス内のベクトルインデックス (Qdrant の代わりに使用)"""
+
+    def __init__(self, dim, path=None):
+        """
+        :param dim: 埋め込みベクトルの次元数
+        :param path: 登録済みのベクトルを保存する .npz ファイル (None の場合は保存しない)
+        """
+        self.dim = dim
+        self.path = path
+        self.user_ids = []
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        if path and os.path.exists(path):
+            data = np.load(path)
+            self.user_ids = [str(v) for v in data["user_ids"]]
+            self.vectors = data["vectors"].astype(np.float32)
+
+    def search_batch(self, vectors):
+        """
+        :param vectors: L2正規化済みの (B, dim) 配列
+        :return: [(user_id, score), ...]。登録がない場合は (None, 0.0)
+        """
+        if not self.user_ids:
+            return [(None, 0.0)] * len(vectors)
+        scores = vectors @ self.vectors.T
+        best = np.argmax(scores, axis=1)
+        return [(self.user_ids[i], float(scores[row, i])) for row, i in enumerate(best)]
+
+    def add_batch(self, user_ids, vectors):
+        self.user_ids.extend(user_ids)
+        self.vectors = np.vstack([self.vectors, np.asarray(vectors, dtype=np.float32)])
+        if self.path:
+            np.savez(self.path, user_ids=np.array(self.user_ids), vectors=self.vectors)
+
+
+class QdrantIndex:
+    """Qdrant のコレクションを使うベクトルインデックス"""
+
+    def __init__(self, dim, host=None, port=None, collection=None):
+        from qdrant_client import QdrantClient
+        from qdrant_client.models import Distance, VectorParams
+
+        self.dim = dim
+        self.collection = collection or config.QDRANT_COLLECTION
+        self.client = QdrantClient(host=host or config.QDRANT_HOST, port=port or config.QDRANT_PORT)
+        if not self.client.collection_exists(self.collection):
+            self.client.create_collection(
+                self.collection,
+                vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+            )
+
+    def search_batch(self, vectors):
+        from qdrant_client.models import QueryRequest
+
+        # search_batch は非推奨になったので、Query API (qdrant-client 1.10 以降) でまとめて検索する
+        requests = [QueryRequest(query=vector.tolist(), limit=1) for vector in vectors]
+        responses = self.client.query_batch_points(self.collection, requests=requests)
+        return [
+            (str(response.points[0].id), response.points[0].score) if response.points else (None, 0.0)
+            for response in responses
+        ]
+
+    def add_batch(self, user_ids, vectors):
+        from qdrant_client.models import PointStruct
+
+        points = [
+            PointStruct(id=user_id, vector=vector.tolist(), payload={"user_id": user_id})
+            for user_id, vector in zip(user_ids, vectors)
+        ]
+        self.client.upsert(self.collection, points=points)
+
+
+class RecentMatches:
+    """最近照合した人物の埋め込みを保持する LRU/TTL キャッシュ"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # user_id -> (embedding, expires_at)
+
+    def lookup(self, embedding, threshold, now):
+        """閾値以上に似ている人物がいればその user_id を返す"""
+        for user_id in [k for k, (_, expires) in self.entries.items() if expires < now]:
+            del self.entries[user_id]
+        if not self.entries:
+            return None
+
+        user_ids = list(self.entries)
+        scores = np.stack([self.entries[k][0] for k in user_ids]) @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+        self.put(user_ids[best], embedding, now)
+        return user_ids[best]
+
+    def put(self, user_id, embedding, now):
+        self.entries[user_id] = (embedding, now + self.ttl)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+class FaceRecognizer:
+    """埋め込みベクトルから利用者の UUID を求め、未登録の顔は新規登録するクラス"""
+
+    def __init__(self, index=None):
+        """
+        :param index: NumpyIndex または QdrantIndex (省略時は config.VECTOR_BACKEND に従って生成)
+        """
+        self.index = index if index is not None else self._create_index()
+        self.threshold = config.RECOGNITION_THRESHOLD
+        self.cache = RecentMatches(config.RECOGNITION_CACHE_SIZE, config.RECOGNITION_CACHE_TTL)
+        self.queue = queue.Queue()
+        self.cache_hits = 0  # キャッシュで照合できた顔の数
+        self.searches = 0  # インデックスを検索した回数 (バッチ単位)
+        self.enrolled = 0  # 新規に登録した人数
+        self._worker = threading.Thread(target=self._worker_loop, name="FaceRecognizer", daemon=True)
+        self._worker.start()
+
+    @staticmethod
+    def _create_index():
+        if config.VECTOR_BACKEND == "qdrant":
+            return QdrantIndex(config.EMBEDDING_DIM)
+        return NumpyIndex(config.EMBEDDING_DIM, config.NUMPY_INDEX_PATH)
+
+    def submit(self, embedding):
+        """
+        埋め込みベクトルの照合を依頼する
+
+        :return: user_id を結果に持つ Future
+        """
+        future = Future()
+        self.queue.put((embedding, future))
+        return future
+
+    def identify(self, embeddings):
+        """
+        複数の埋め込みベクトルをまとめて照合する
+
+        :param embeddings: L2正規化済みの (B, dim) 配列
+        :return: user_id のリスト
+        """
+        now = time.time()
+        user_ids = [self.cache.lookup(embedding, self.threshold, now) for embedding in embeddings]
+        self.cache_hits += sum(user_id is not None for user_id in user_ids)
+
+        # キャッシュにない顔だけをまとめて検索する
+        pending = [i for i, user_id in enumerate(user_ids) if user_id is None]
+        if pending:
+            self.searches += 1
+            results = self.index.search_batch(embeddings[pending])
+            new_ids, new_vectors = [], []
+            for i, (user_id, score) in zip(pending, results):
+                if user_id is None or score < self.threshold:
+                    # 同じバッチで先に登録した人物と同じ顔なら、その user_id を使う
+                    user_id = self.cache.lookup(embeddings[i], self.threshold, now)
+                if user_id is None:
+                    user_id = str(uuid.uuid4())
+                    new_ids.append(user_id)
+                    new_vectors.append(embeddings[i])
+                    print(f"🆕 Enrolled new user: {user_id}")
+                user_ids[i] = user_id
+                self.cache.put(user_id, embeddings[i], now)
+            if new_ids:
+                self.index.add_batch(new_ids, np.stack(new_vectors))
+                self.enrolled += len(new_ids)
+        return user_ids
+
+    def stats(self):
+        """照合の状況のカウンタを返す"""
+        return {
+            "cache_hits": self.cache_hits,
+            "searches": self.searches,
+            "enrolled": self.enrolled,
+            "queue_depth": self.queue.qsize(),
+        }
+
+    def _worker_loop(self):
+        """依頼を RECOGNITION_MAX_WAIT 秒まで待ってまとめ、一度に照合する"""
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + config.RECOGNITION_MAX_WAIT
+            while len(batch) < config.RECOGNITION_BATCH_SIZE:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            futures = [future for _, future in batch]
+            try:
+                user_ids = self.identify(np.stack([embedding for embedding, _ in batch]))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, user_id in zip(futures, user_ids):
+                future.set_result(user_id)
@@ -0,0 +1,319 @@
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api.game_state import GameState
+from api.receiver import ReceiverTCP
+from api.sender import SenderTCP
+from camera import Camera
+from config import config
+from cpu_budget import apply_cpu_budget, session_options
+from detection import BatchDetector, FaceDetector
+from discovery import resolve_camera_map
+from frame_bus import CaptureProcesses, SharedFrameSource
+from governor import FrameGovernor
+from journal import Journal
+from identification import FaceIdentification
+from metrics import metrics, startup
+from preview import create_preview, install_signal_handlers
+from recognition import FaceRecognizer
+
+
+class FPSCounter:
+    """一定間隔ごとのフレームレートを計測するクラス"""
+
+    def __init__(self):
+        self.frames = 0
+        self.start_time = time.perf_counter()
+
+    def tick(self):
+        """処理したフレームを1つ数える"""
+        self.frames += 1
+
+    def reset(self):
+        """計測値を返してカウンタをリセットする"""
+        now = time.perf_counter()
+        elapsed = now - self.start_time
+        fps = self.frames / elapsed if elapsed > 0 else 0.0
+        self.frames = 0
+        self.start_time = now
+        return fps
+
+
+class MultiCameraRunner:
+    """1つの FaceDetector を共有して複数カメラを1プロセスで処理するクラス"""
+
+    def __init__(self, camera_map):
+        """
+        :param camera_map: {camera_index: machine_id}
+        """
+        # キャプチャを別プロセスに分ける場合は、共有メモリのフレームバスから読む
+        self.capture = None
+        if config.FRAME_BUS == "spawn":
+            self.capture = CaptureProcesses(camera_map).start()
+        use_bus = config.FRAME_BUS in ("spawn", "attach")
+
+        # バッチ推論では各カメラを別スレッドで動かし、同時に出た検出要求をまとめる
+        self.batching = config.DET_BATCH_SIZE > 1
+        # 共有する1つの検出モデルに、このプロセスが担当するカメラの分のコアを使わせる
+        with startup.phase("detector"):
+            threads = apply_cpu_budget(list(camera_map.values()))
+            detector = FaceDetector(session_options=session_options(threads))
+            self.detector = BatchDetector(detector) if self.batching else detector
+        self.sender = SenderTCP()
+        self.game_state = GameState(config.GAME_STATUS)
+        self.receiver = ReceiverTCP(game_state=self.game_state) if config.RECEIVER_ENABLED else None
+        self.recognizer = None
+        if config.RECOGNITION_ENABLED:
+            with startup.phase("recognizer"):
+                self.recognizer = FaceRecognizer()
+        self.stop_event = threading.Event()
+        self.preview = create_preview(on_close=self.stop_event.set)
+        # 全カメラで1つの予算を分け合い、先に処理されたカメラが CPU を使い切らないようにする
+        self.governor = FrameGovernor() if config.GOVERNOR_ENABLED else None
+        self.journal = Journal() if config.JOURNAL_ENABLED else None
+        if use_bus:
+            sources = {camera_index: SharedFrameSource(camera_index) for camera_index in camera_map}
+        else:
+            with startup.phase("cameras"):
+                sources = self.open_cameras(camera_map)
+        self.identifiers = [
+            FaceIdentification(
+                input_cindex=camera_index,
+                output_cindex=machine_id,
+                detector=self.detector,
+                sender=self.sender,
+                game_state=self.game_state,
+                recognizer=self.recognizer,
+                preview=self.preview,
+                source=sources[camera_index],
+                governor=self.governor,
+                journal=self.journal,
+            )
+            for camera_index, machine_id in camera_map.items()
+        ]
+        self.fps_counters = {ident.output_cindex: FPSCounter() for ident in self.identifiers}
+        self.last_report = time.perf_counter()
+        self.last_cpu_time = time.process_time()
+
+    @staticmethod
+    def open_cameras(camera_map):
+        """
+        全カメラを並行して開く (1台ずつ開くとデバイスの初期化を待つ時間が台数分かかる)
+
+        :return: {camera_index: Camera}
+        """
+        with ThreadPoolExecutor(max_workers=len(camera_map)) as executor:
+            futures = {camera_index: executor.submit(Camera, camera_index) for camera_index in camera_map}
+        cameras, errors = {}, []
+        for camera_index, future in futures.items():
+            try:
+                cameras[camera_index] = future.result()
+            except RuntimeError as e:
+                errors.append(e)
+        if errors:
+            for camera in cameras.values():
+                camera.release()
+            raise errors[0]
+        return cameras
+
+    def run_round(self, offset):
+        """
+        全カメラを1フレームずつ処理する。開始カメラを毎回ずらして偏りを防ぐ
+
+        :return: 処理したフレーム数
+        """
+        count = len(self.identifiers)
+        processed = 0
+        for i in range(count):
+            ident = self.identifiers[(offset + i) % count]
+            if ident.step():
+                self.fps_counters[ident.output_cindex].tick()
+                processed += 1
+        return processed
+
+    def camera_loop(self, ident):
+        """1台分の処理を専用のスレッドで繰り返す (バッチ推論の場合)"""
+        counter = self.fps_counters[ident.output_cindex]
+        try:
+            while not self.stop_event.is_set():
+                if ident.is_paused():
+                    _, version = self.game_state.get()
+                    self.game_state.wait_for_change(version, timeout=0.1)
+                elif ident.step():
+                    counter.tick()
+                else:
+                    self.stop_event.wait(0.001)
+        except Exception:
+            self.stop_event.set()
+            raise
+
+    def wait_while_paused(self):
+        """ゲーム中で全カメラが停止している間は、状態が変わるまで CPU を使わずに待つ"""
+        if all(ident.is_paused() for ident in self.identifiers):
+            _, version = self.game_state.get()
+            self.game_state.wait_for_change(version, timeout=0.1)
+
+    def report_fps(self):
+        """一定間隔ごとにカメラ別のFPSを表示する"""
+        now = time.perf_counter()
+        if now - self.last_report < config.FPS_REPORT_INTERVAL:
+            return
+        cpu_time = time.process_time()
+        cpu_usage = (cpu_time - self.last_cpu_time) / (now - self.last_report) * 100
+        self.last_report = now
+        self.last_cpu_time = cpu_time
+        summary = ", ".join(
+            self._format_camera_fps(ident) for ident in self.identifiers
+        )
+        print(f"📈 FPS | {summary} | CPU {cpu_usage:.0f}%")
+
+        sender = self.sender.stats()
+        latency = f"{sender['last_latency'] * 1000:.1f}ms" if sender["last_latency"] is not None else "-"
+        print(
+            f"📡 Sender | queue {sender['queue_depth']}, sent {sender['sent']}, "
+            f"failed {sender['failed']}, dropped {sender['dropped']}, latency {latency}"
+        )
+        if self.recognizer is not None:
+            recognition = self.recognizer.stats()
+            print(
+                f"🧠 Recognizer | cache hits {recognition['cache_hits']}, searches {recognition['searches']}, "
+                f"enrolled {recognition['enrolled']}, queue {recognition['queue_depth']}"
+            )
+        if self.governor is not None:
+            decisions = ", ".join(
+                f"Camera{machine_id:02d}: {d['fps']:.1f}fps x{d['scale']:.2f} "
+                f"({d['share'] * 100:.0f}%, {d['cost'] * 1000:.0f}ms, lat {d['latency'] * 1000:.0f}ms"
+                f"{', face' if d['face'] else ''})"
+                for machine_id, d in sorted(self.governor.stats().items())
+            )
+            print(f"⚖️ Governor | load {self.governor.load_factor:.2f} | {decisions}")
+        if self.journal is not None:
+            journal = self.journal.stats()
+            print(f"📒 Journal | written {journal['written']}, dropped {journal['dropped']}, queue {journal['queue_depth']}")
+        if self.batching:
+            batch = self.detector.stats()
+            print(f"🧮 Batch | {batch['batches']} batches, mean size {batch['mean_batch_size']:.2f}")
+
+    def _format_camera_fps(self, ident):
+        """カメラ1台分のFPSとフレームのドロップ・重複数を整形する"""
+        fps = self.fps_counters[ident.output_cindex].reset()
+        stats = ident.camera.stats()
+        text = f"{ident.window_name}: {fps:.1f} (drop {stats['dropped']}, dup {stats['duplicate']}"
+        if stats.get("reconnects") or not stats.get("connected", True):
+            state = "up" if stats["connected"] else "DOWN"
+            text += f", {state}, reconnects {stats['reconnects']}, downtime {stats['downtime']:.0f}s"
+        if ident.motion_gate is not None:
+            gate = ident.motion_gate.stats()
+            text += f", skip {gate['skipped']}/{gate['skipped'] + gate['inferences']}"
+        if ident.quality_gate is not None:
+            quality = ident.quality_gate.stats()
+            text += f", low quality {quality['rejected']}/{quality['assessed']}"
+        return text + ")"
+
+    def start_metrics(self):
+        """メトリクスの HTTP エンドポイントと定期的なログ出力を開始する"""
+        if not metrics.enabled:
+            return
+        metrics.gauge("sender_queue_depth", lambda: {"all": self.sender.stats()["queue_depth"]})
+        if self.recognizer is not None:
+            for name, key in (("recognition_cache_hits", "cache_hits"), ("recognition_searches", "searches"),
+                              ("recognition_enrolled", "enrolled"), ("recognition_queue_depth", "queue_depth")):
+                metrics.gauge(name, lambda key=key: {"all": self.recognizer.stats()[key]})
+        for name, key in (("frames_dropped", "dropped"), ("camera_connected", "connected"),
+                          ("camera_reconnects", "reconnects"), ("camera_downtime_seconds", "downtime")):
+            metrics.gauge(name, lambda key=key: {
+                ident.output_cindex: int(stats[key]) if isinstance(stats[key], bool) else stats[key]
+                for ident in self.identifiers
+                for stats in [ident.camera.stats()]
+                if key in stats
+            })
+        # 静止したシーンで検出を止めている割合を、カメラ別に確認できるようにする
+        gated = [ident for ident in self.identifiers if ident.motion_gate is not None]
+        if gated:
+            for name, key in (("motion_skipped_frames", "skipped"), ("motion_inferences", "inferences"),
+                              ("motion_skip_ratio", "skip_ratio"), ("motion_ratio", "motion_ratio"),
+                              ("motion_gate_cpu_seconds", "gate_cpu_time")):
+                metrics.gauge(name, lambda key=key: {
+                    ident.output_cindex: ident.motion_gate.stats()[key] for ident in gated
+                })
+        if self.governor is not None:
+            for name, key in (("governor_target_fps", "fps"), ("governor_scale", "scale"),
+                              ("governor_share", "share"), ("governor_latency_seconds", "latency")):
+                metrics.gauge(name, lambda key=key: {
+                    machine_id: decision[key] for machine_id, decision in self.governor.stats().items()
+                })
+        if config.METRICS_HTTP_ENABLED:
+            try:
+                metrics.start_http_server()
+            except OSError as e:
+                print(f"❌ Metrics server could not start: {e}")
+        metrics.start_log_summary()
+
+    def run(self):
+        """ラウンドロビンで全カメラの顔識別処理を実行"""
+        print(f"🚀 Starting identification({len(self.identifiers)} cameras)...")
+
+        install_signal_handlers(self.stop_event)
+        if self.receiver is not None:
+            self.receiver.start_in_thread()
+        self.start_metrics()
+        if config.WARMUP_ENABLED:
+            with startup.phase("warm-up"):
+                for ident in self.identifiers:
+                    ident.warmup()
+        startup.report()
+
+        threads = []
+        if self.batching:
+            threads = [
+                threading.Thread(target=self.camera_loop, args=(ident,), name=ident.window_name, daemon=True)
+                for ident in self.identifiers
+            ]
+            for thread in threads:
+                thread.start()
+
+        offset = 0
+        try:
+            while not self.stop_event.is_set():
+                if threads:
+                    self.stop_event.wait(0.1)
+                else:
+                    if not self.run_round(offset):
+                        # どのカメラにも新しいフレームがない間は CPU を使い切らないように少し待つ
+                        self.stop_event.wait(0.001)
+                    offset = (offset + 1) % len(self.identifiers)
+                    self.wait_while_paused()
+                self.report_fps()
+        finally:
+            self.stop_event.set()
+            for thread in threads:
+                thread.join(timeout=1.0)
+            for ident in self.identifiers:
+                ident.release()
+            self.sender.close()
+            if self.journal is not None:
+                self.journal.close()
+            if self.receiver is not None:
+                self.receiver.stop()
+            metrics.stop()
+            if self.preview is not None:
+                self.preview.stop()
+            if self.capture is not None:
+                self.capture.stop()
+            print("🛑 Stopped identification.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="複数カメラの顔識別を1プロセスで実行する")
+    parser.add_argument(
+        "camera_map",
+        nargs="?",
+        default=config.CAMERA_MAP,
+        help="camera_index:machine_id のカンマ区切り (例: 4:0,2:1,5:2,3:3)、auto の場合はカメラを探して決める",
+    )
+    args = parser.parse_args()
+
+    runner = MultiCameraRunner(resolve_camera_map(args.camera_map))
+    runner.run()
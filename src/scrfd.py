@@ -0,0 +1,166 @@
+import cv2
+import numpy as np
+
+from cpu_budget import create_session
+
+
+def letterbox(image, input_size):
+    """
+    縦横比を保って input_size に縮小し、右下を0で埋める (insightface の RetinaFace.detect と同じ前処理)
+
+    :return: (det_img, det_scale)
+    """
+    input_w, input_h = input_size
+    h, w = image.shape[:2]
+    if h / w > input_h / input_w:
+        new_h, new_w = input_h, int(input_h / (h / w))
+    else:
+        new_w, new_h = input_w, int(input_w * (h / w))
+    det_img = np.zeros((input_h, input_w, 3), dtype=np.uint8)
+    det_img[:new_h, :new_w] = cv2.resize(image, (new_w, new_h))
+    return det_img, new_h / h
+
+
+def distance2bbox(points, distance):
+    """アンカーの中心からの距離を [x1, y1, x2, y2] に変換する"""
+    return np.stack([
+        points[:, 0] - distance[:, 0],
+        points[:, 1] - distance[:, 1],
+        points[:, 0] + distance[:, 2],
+        points[:, 1] + distance[:, 3],
+    ], axis=-1)
+
+
+def distance2kps(points, distance):
+    """アンカーの中心からの距離をランドマークの座標に変換する"""
+    preds = []
+    for i in range(0, distance.shape[1], 2):
+        preds.append(points[:, 0] + distance[:, i])
+        preds.append(points[:, 1] + distance[:, i + 1])
+    return np.stack(preds, axis=-1)
+
+
+def nms(dets, thresh):
+    """スコア順に、IoU が thresh を超えて重なる枠を取り除く"""
+    x1, y1, x2, y2, scores = dets[:, 0], dets[:, 1], dets[:, 2], dets[:, 3], dets[:, 4]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        w = np.maximum(0.0, np.minimum(x2[i], x2[order[1:]]) - np.maximum(x1[i], x1[order[1:]]) + 1)
+        h = np.maximum(0.0, np.minimum(y2[i], y2[order[1:]]) - np.maximum(y1[i], y1[order[1:]]) + 1)
+        inter = w * h
+        overlap = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[np.where(overlap <= thresh)[0] + 1]
+    return keep
+
+
+def decode_outputs(model, net_outs, index, count, input_size, det_scale):
+    """
+    バッチの出力から index 番目の画像の bboxes と kpss を取り出す (RetinaFace.forward と同じ後処理)
+
+    :param model: SCRFDDetector または insightface の RetinaFace
+    :return: (bboxes, kpss)。入力画像の座標の bboxes (N, 5) と kpss (N, 5, 2)
+    """
+    input_w, input_h = input_size
+    fmc = model.fmc
+    scores_list, bboxes_list, kpss_list = [], [], []
+    for idx, stride in enumerate(model._feat_stride_fpn):
+        # 出力は (count, K, C) または (count * K, C) のどちらか
+        scores = net_outs[idx].reshape(count, -1, net_outs[idx].shape[-1])[index]
+        bbox_preds = net_outs[idx + fmc].reshape(count, -1, 4)[index] * stride
+
+        height, width = input_h // stride, input_w // stride
+        key = (height, width, stride)
+        anchor_centers = model.center_cache.get(key)
+        if anchor_centers is None:
+            anchor_centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+            anchor_centers = (anchor_centers * stride).reshape((-1, 2))
+            if model._num_anchors > 1:
+                anchor_centers = np.stack([anchor_centers] * model._num_anchors, axis=1).reshape((-1, 2))
+            if len(model.center_cache) < 100:
+                model.center_cache[key] = anchor_centers
+
+        pos_inds = np.where(scores >= model.det_thresh)[0]
+        scores_list.append(scores[pos_inds])
+        bboxes_list.append(distance2bbox(anchor_centers, bbox_preds)[pos_inds])
+        if model.use_kps:
+            kps_preds = net_outs[idx + fmc * 2].reshape(count, -1, 10)[index] * stride
+            kpss = distance2kps(anchor_centers, kps_preds).reshape((-1, 5, 2))
+            kpss_list.append(kpss[pos_inds])
+
+    scores = np.vstack(scores_list)
+    order = scores.ravel().argsort()[::-1]
+    pre_det = np.hstack((np.vstack(bboxes_list) / det_scale, scores)).astype(np.float32, copy=False)
+    pre_det = pre_det[order, :]
+    keep = model.nms(pre_det)
+    kpss = None
+    if model.use_kps:
+        kpss = (np.vstack(kpss_list) / det_scale)[order][keep]
+    return pre_det[keep, :], kpss
+
+
+class SCRFDDetector:
+    """
+    SCRFD / RetinaFace 形式の検出モデル (det_10g など) を ONNX Runtime で直接実行するクラス
+
+    insightface の RetinaFace と同じ属性と detect() を持つ。insightface を import すると albumentations や
+    matplotlib まで読み込まれて起動が遅くなるので、検出だけの場合はこちらを使う。
+    """
+
+    def __init__(self, model_path, session_options=None, providers=None):
+        self.model_file = model_path
+        self.taskname = "detection"
+        self.session = create_session(model_path, session_options, providers or ["CPUExecutionProvider"])
+
+        input_cfg = self.session.get_inputs()[0]
+        self.input_shape = input_cfg.shape
+        self.input_name = input_cfg.name
+        self.input_size = None if isinstance(self.input_shape[2], str) else tuple(self.input_shape[2:4][::-1])
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        self.input_mean = 127.5
+        self.input_std = 128.0
+        self.det_thresh = 0.5
+        self.nms_thresh = 0.4
+        self.center_cache = {}
+
+        # 出力の数から特徴マップの数とランドマークの有無を判断する
+        outputs = len(self.output_names)
+        self.use_kps = outputs in (9, 15)
+        self.fmc = 3 if outputs in (6, 9) else 5
+        self._feat_stride_fpn = [8, 16, 32] if self.fmc == 3 else [8, 16, 32, 64, 128]
+        self._num_anchors = 2 if self.fmc == 3 else 1
+
+    def prepare(self, ctx_id, input_size=None, det_thresh=None, nms_thresh=None):
+        if det_thresh is not None:
+            self.det_thresh = det_thresh
+        if nms_thresh is not None:
+            self.nms_thresh = nms_thresh
+        if input_size is not None and self.input_size is None:
+            self.input_size = tuple(input_size)
+
+    def nms(self, dets):
+        return nms(dets, self.nms_thresh)
+
+    def detect(self, img, input_size=None, max_num=0, metric="default"):
+        """
+        :return: (bboxes, kpss)。bboxes (N, 5) [x1, y1, x2, y2, score] と kpss (N, 5, 2)
+        """
+        input_size = tuple(input_size or self.input_size)
+        det_img, det_scale = letterbox(img, input_size)
+        blob = cv2.dnn.blobFromImage(
+            det_img, 1.0 / self.input_std, input_size,
+            (self.input_mean, self.input_mean, self.input_mean), swapRB=True,
+        )
+        net_outs = self.session.run(self.output_names, {self.input_name: blob})
+        bboxes, kpss = decode_outputs(self, net_outs, 0, 1, input_size, det_scale)
+
+        if max_num > 0 and bboxes.shape[0] > max_num:
+            areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+            keep = np.argsort(areas)[::-1][:max_num]
+            bboxes = bboxes[keep]
+            kpss = kpss[keep] if kpss is not None else None
+        return bboxes, kpss
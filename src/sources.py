@@ -0,0 +1,197 @@
+import glob
+import os
+import time
+from abc import ABC, abstractmethod
+
+import cv2
+import numpy as np
+
+from camera import Camera
+from config import config
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class FrameSource(ABC):
+    """
+    フレーム取得元の共通処理
+
+    Camera と同じく get_frame() / read() / stats() / release() を持ち、FaceIdentification に
+    カメラの代わりに渡せる。すべてのフレームを返し終えると exhausted が True になる。
+    """
+
+    def __init__(self, name, fps=None, realtime=False, loop=False):
+        """
+        :param name: 表示用の名前
+        :param fps: 元の映像のフレームレート (realtime の場合の再生速度)
+        :param realtime: True の場合は fps に合わせて再生し、処理が遅れた分のフレームを捨てる
+        :param loop: True の場合は最後まで読んだら最初に戻る
+        """
+        self.index = name
+        self.fps = fps or 30.0
+        self.realtime = realtime
+        self.loop = loop
+        self.exhausted = False
+        self.seq = 0
+        self.timestamp = None
+        self.start_time = None
+        self.captured_frames = 0
+        self.dropped_frames = 0
+        self.duplicate_frames = 0
+
+    @abstractmethod
+    def _read_next(self):
+        """次のフレームを返す。終わりに達した場合は None"""
+
+    @abstractmethod
+    def _rewind(self):
+        """最初のフレームに戻る"""
+
+    def _next_frame(self):
+        frame = self._read_next()
+        if frame is None and self.loop:
+            self._rewind()
+            frame = self._read_next()
+        if frame is None:
+            self.exhausted = True
+        else:
+            self.captured_frames += 1
+        return frame
+
+    def get_frame(self):
+        if self.exhausted:
+            return None
+
+        if self.realtime:
+            # 経過時間に対応するフレームまで読み飛ばし、ライブカメラと同じく最新フレームだけを返す
+            now = time.perf_counter()
+            if self.start_time is None:
+                self.start_time = now
+            target = int((now - self.start_time) * self.fps) + 1
+            if target <= self.seq:
+                self.duplicate_frames += 1
+                return None
+            frame = None
+            while self.seq < target:
+                next_frame = self._next_frame()
+                if next_frame is None:
+                    break
+                if frame is not None:
+                    self.dropped_frames += 1
+                frame = next_frame
+                self.seq += 1
+        else:
+            frame = self._next_frame()
+            if frame is not None:
+                self.seq += 1
+
+        self.timestamp = time.time()
+        return frame
+
+    def read(self, timeout=0.0):
+        frame = self.get_frame()
+        return frame, self.seq, self.timestamp
+
+    def stats(self):
+        return {
+            "captured": self.captured_frames,
+            "dropped": self.dropped_frames,
+            "duplicate": self.duplicate_frames,
+            "seq": self.seq,
+        }
+
+    def release(self):
+        pass
+
+
+class VideoFileSource(FrameSource):
+    """録画したブースの映像ファイルからフレームを読むソース"""
+
+    def __init__(self, path, realtime=False, loop=False):
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"❌ 動画 {path} を開けませんでした。")
+        super().__init__(os.path.basename(path), self.cap.get(cv2.CAP_PROP_FPS), realtime, loop)
+
+    def _read_next(self):
+        ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def _rewind(self):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageDirectorySource(FrameSource):
+    """ディレクトリ内の画像をファイル名順にフレームとして読むソース"""
+
+    def __init__(self, path, fps=None, realtime=False, loop=False):
+        self.paths = sorted(
+            p for p in glob.glob(os.path.join(path, "*")) if p.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.paths:
+            raise RuntimeError(f"❌ {path} に画像がありません。")
+        self.position = 0
+        super().__init__(os.path.basename(os.path.normpath(path)), fps, realtime, loop)
+
+    def _read_next(self):
+        if self.position >= len(self.paths):
+            return None
+        frame = cv2.imread(self.paths[self.position])
+        self.position += 1
+        return frame
+
+    def _rewind(self):
+        self.position = 0
+
+
+class SyntheticSource(FrameSource):
+    """ノイズの背景に矩形 (または顔画像) が動く合成フレームを生成するソース"""
+
+    def __init__(self, count=300, face_image=None, fps=None, realtime=False, loop=False, seed=0):
+        """
+        :param count: 生成するフレーム数
+        :param face_image: 背景に貼り付けて動かす顔画像のパス (省略時は矩形)
+        """
+        self.count = count
+        self.position = 0
+        self.rng = np.random.default_rng(seed)
+        self.background = self.rng.integers(0, 64, (config.FRAME_HEIGHT, config.FRAME_WIDTH, 3), dtype=np.uint8)
+        self.face = cv2.imread(face_image) if face_image else None
+        super().__init__("synthetic", fps, realtime, loop)
+
+    def _read_next(self):
+        if self.position >= self.count:
+            return None
+        frame = self.background.copy()
+        h, w = frame.shape[:2]
+        patch = self.face if self.face is not None else np.full((h // 3, h // 4, 3), 200, dtype=np.uint8)
+        ph, pw = min(patch.shape[0], h), min(patch.shape[1], w)
+        # フレームごとに左右へ往復させる
+        phase = (self.position % 120) / 120
+        x = int((w - pw) * (1 - abs(2 * phase - 1)))
+        y = (h - ph) // 2
+        frame[y:y + ph, x:x + pw] = patch[:ph, :pw]
+        self.position += 1
+        return frame
+
+    def _rewind(self):
+        self.position = 0
+
+
+def open_source(spec, realtime=False, loop=False):
+    """
+    文字列からフレームソースを生成する
+
+    :param spec: カメラ番号 ("4")、動画ファイル、画像ディレクトリ、"synthetic" または "synthetic:フレーム数"
+    """
+    if str(spec).isdigit():
+        return Camera(int(spec))
+    if str(spec).startswith("synthetic"):
+        _, _, count = str(spec).partition(":")
+        return SyntheticSource(int(count) if count else 300, realtime=realtime, loop=loop)
+    if os.path.isdir(spec):
+        return ImageDirectorySource(spec, realtime=realtime, loop=loop)
+    return VideoFileSource(spec, realtime=realtime, loop=loop)
@@ -0,0 +1,230 @@
+import cv2
+import numpy as np
+
+from config import config
+
+
+def iou(box_a, box_b):
+    """2つの枠 [x1, y1, x2, y2] の IoU を計算する"""
+    x1 = max(box_a[0], box_b[0])
+    y1 = max(box_a[1], box_b[1])
+    x2 = min(box_a[2], box_b[2])
+    y2 = min(box_a[3], box_b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """枠の配列 (N, 4) と (M, 4) のすべての組み合わせの IoU を (N, M) で返す"""
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = w * h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0.0)
+
+
+class Track:
+    """追跡中の顔1つ分の状態"""
+
+    def __init__(self, track_id, box, score=1.0, kps=None):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.score = float(score)
+        self.kps = kps  # 最後に検出モデルで見つけた時のランドマーク (オプティカルフロー中は None)
+        self.detected = True  # このフレームで検出モデルが見つけたか (ランドマークのないモデルでも判定できる)
+        self.confidence = 1.0
+        self.points = None
+        self.misses = 0  # 連続して検出できなかった回数
+
+        # FaceIdentification が使う、この顔 (人) ごとの状態
+        self.large = False  # ヒステリシス付きの大きさの判定
+        self.persist_start = None
+        self.last_event = None
+        self.identity = None  # 照合結果の user_id を返す Future
+        self.quality_start = None  # 品質の閾値を初めて満たした時刻
+        self.best_quality = 0.0
+        self.best_crop = None  # 候補期間中で最も品質の良い顔の切り出し画像とそのランドマーク
+        self.best_kps = None
+
+    def bbox(self):
+        """枠を整数の [x1, y1, x2, y2] で返す"""
+        return [int(v) for v in self.box]
+
+    def area(self):
+        x1, y1, x2, y2 = self.box
+        return float((x2 - x1) * (y2 - y1))
+
+
+class FaceTracker:
+    """
+    複数の顔を追跡するトラッカー
+
+    検出結果を IoU でトラックに対応付け、数フレームごとの検出の間はオプティカルフローで補間する。
+    検出が一時的に途切れても grace_frames 回まではトラックを残すので、顔ごとの継続時間がリセットされない。
+    """
+
+    def __init__(self, detect_interval=None, min_confidence=None, iou_threshold=None, grace_frames=None):
+        """
+        :param detect_interval: 検出モデルを実行するフレーム間隔 (省略時は config.DETECT_INTERVAL)
+        :param min_confidence: これを下回ると次のフレームで再検出する信頼度 (省略時は config.TRACK_MIN_CONFIDENCE)
+        :param iou_threshold: 検出結果を同じトラックとみなす IoU (省略時は config.TRACK_IOU_THRESHOLD)
+        :param grace_frames: 見つからなくてもトラックを残す検出の回数 (省略時は config.TRACK_GRACE_FRAMES)
+        """
+        self.detect_interval = detect_interval or config.DETECT_INTERVAL
+        self.min_confidence = config.TRACK_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.iou_threshold = config.TRACK_IOU_THRESHOLD if iou_threshold is None else iou_threshold
+        self.grace_frames = config.TRACK_GRACE_FRAMES if grace_frames is None else grace_frames
+        self.tracks = []
+        self.next_id = 1
+        self.frames_since_detect = 0
+        self.prev_gray = None
+
+    def reset(self):
+        """追跡中のトラックを破棄する"""
+        self.tracks = []
+        self.prev_gray = None
+        self.frames_since_detect = 0
+
+    def visible(self):
+        """直近の検出で見つかっているトラックを返す (猶予中のトラックは含まない)"""
+        return [track for track in self.tracks if track.misses == 0]
+
+    def needs_detection(self):
+        """次のフレームで検出モデルを実行すべきかを返す"""
+        visible = self.visible()
+        return (
+            not visible
+            or len(visible) < len(self.tracks)
+            or self.frames_since_detect + 1 >= self.detect_interval
+            or any(track.confidence < self.min_confidence for track in visible)
+        )
+
+    def update(self, frame, boxes, scores=None, kpss=None):
+        """
+        検出結果でトラックを更新する
+
+        :param frame: 検出したフレーム
+        :param boxes: 検出した枠の配列 (N, 4) [x1, y1, x2, y2]
+        :param scores: 検出のスコア (N,)
+        :param kpss: ランドマーク (N, 5, 2)
+        :return: このフレームで見えているトラックのリスト
+        """
+        self.frames_since_detect = 0
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        matched_tracks, matched_boxes = set(), set()
+        if self.tracks and len(boxes):
+            # IoU の大きい組から順に対応付ける
+            overlaps = iou_matrix(np.stack([track.box for track in self.tracks]), boxes)
+            for flat in np.argsort(overlaps, axis=None)[::-1]:
+                t, b = np.unravel_index(flat, overlaps.shape)
+                if overlaps[t, b] < self.iou_threshold:
+                    break
+                if t in matched_tracks or b in matched_boxes:
+                    continue
+                matched_tracks.add(t)
+                matched_boxes.add(b)
+                track = self.tracks[t]
+                track.box = boxes[b]
+                track.score = float(scores[b]) if scores is not None else 1.0
+                track.kps = kpss[b] if kpss is not None else None
+                track.detected = True
+                track.confidence = 1.0
+                track.misses = 0
+
+        survivors = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                track.kps = None
+                track.detected = False
+                if track.misses > self.grace_frames:
+                    continue
+            survivors.append(track)
+        for b in range(len(boxes)):
+            if b not in matched_boxes:
+                survivors.append(Track(
+                    self.next_id, boxes[b],
+                    scores[b] if scores is not None else 1.0,
+                    kpss[b] if kpss is not None else None,
+                ))
+                self.next_id += 1
+        self.tracks = survivors
+
+        visible = self.visible()
+        if self.detect_interval > 1 and visible:
+            self.prev_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            for track in visible:
+                track.points = self._find_points(self.prev_gray, track.box)
+        return visible
+
+    def propagate(self, frame):
+        """
+        前フレームからのオプティカルフローで見えているトラックの枠を移動させる
+
+        :return: 見えているトラックのリスト
+        """
+        visible = self.visible()
+        self.frames_since_detect += 1
+        for track in visible:
+            track.kps = None
+            track.detected = False
+        trackable = [track for track in visible if track.points is not None and len(track.points) >= 3]
+        for track in visible:
+            if track not in trackable:
+                track.confidence = 0.0
+        if not trackable:
+            return visible
+
+        # 全トラックの特徴点をまとめて1回で計算する
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        points = np.concatenate([track.points for track in trackable])
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.prev_gray, gray, points, None, winSize=(15, 15), maxLevel=2
+        )
+        start = 0
+        for track in trackable:
+            end = start + len(track.points)
+            self._move(track, track.points, new_points[start:end], status[start:end].reshape(-1) == 1)
+            start = end
+        self.prev_gray = gray
+        return visible
+
+    @staticmethod
+    def _move(track, points, new_points, good):
+        """1つのトラックの特徴点の移動から、枠の平行移動と拡大率を求める"""
+        if good.sum() < 3:
+            track.confidence = 0.0
+            return
+
+        old = points[good].reshape(-1, 2)
+        new = new_points[good].reshape(-1, 2)
+
+        # 特徴点の移動量の中央値で平行移動、重心からの距離の比で拡大率を推定する
+        shift = np.median(new - old, axis=0)
+        old_spread = np.linalg.norm(old - old.mean(axis=0), axis=1)
+        new_spread = np.linalg.norm(new - new.mean(axis=0), axis=1)
+        valid = old_spread > 1e-3
+        scale = float(np.median(new_spread[valid] / old_spread[valid])) if valid.any() else 1.0
+
+        x1, y1, x2, y2 = track.box
+        cx, cy = (x1 + x2) / 2 + shift[0], (y1 + y2) / 2 + shift[1]
+        half_w, half_h = (x2 - x1) * scale / 2, (y2 - y1) * scale / 2
+        track.box = np.array([cx - half_w, cy - half_h, cx + half_w, cy + half_h], dtype=np.float32)
+        track.confidence *= good.sum() / len(points)
+        track.points = new.reshape(-1, 1, 2)
+
+    @staticmethod
+    def _find_points(gray, box):
+        """枠の内側から追跡しやすい特徴点を選ぶ"""
+        h, w = gray.shape
+        x1, y1, x2, y2 = [int(v) for v in box]
+        mask = np.zeros_like(gray)
+        mask[max(0, y1):min(h, y2), max(0, x1):min(w, x2)] = 255
+        return cv2.goodFeaturesToTrack(gray, maxCorners=30, qualityLevel=0.01, minDistance=5, mask=mask)